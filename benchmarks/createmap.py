@@ -0,0 +1,180 @@
+"""
+Benchmark of building and saving a map, stage by stage, on synthetic flows.
+Generates flows between random endpoints at a configurable scale, builds the map with createMap and saveMap,
+records every stage they report through profileCallbacks (wall and cpu time, peak traced memory) and the size
+of the saved map, and writes the results as json so runs of different versions can be compared.
+
+Usage: python benchmarks/createmap.py [--rows 1000 100000 ...] [--endpoints N] [--edges N] [--intra RATIO]
+                                      [--plot] [--bulk] [--lazy] [--workers N] [--output results.json] [--compare old.json]
+"""
+
+import os
+import sys
+import json
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import ra
+
+def flows(rows, endpoints = 200, edges = 2000, intra = 0.2, skew = 1.0, seed = 0):
+    """
+    Creates a dataframe of random flows.
+    rows: The amount of flows.
+    endpoints: The amount of distinct locations.
+    edges: The amount of distinct location pairs the inter-communication flows are spread over.
+    intra: The share of flows that stay within one location.
+    skew: Flows per edge fall off as rank**-skew, 0 spreads them evenly.
+    """
+    rng = np.random.default_rng(seed)
+    edges = min(edges, endpoints*(endpoints - 1)//2)
+    lat = np.round(rng.uniform(-60, 70, endpoints), 4)
+    long = np.round(rng.uniform(-180, 180, endpoints), 4)
+    pairs = np.empty((0, 2), dtype = 'int64')
+    while len(pairs) < edges:
+        sample = rng.integers(0, endpoints, (2*edges, 2))
+        sample = np.sort(sample[sample[:,0] != sample[:,1]], axis = 1)
+        pairs = np.unique(np.vstack([pairs, sample]), axis = 0)
+    pairs = pairs[rng.permutation(len(pairs))[:edges]]
+    weights = (np.arange(edges) + 1.0)**-skew
+    chosen = pairs[rng.choice(edges, size = rows, p = weights/weights.sum())]
+    flip = rng.random(rows) < 0.5
+    src = np.where(flip, chosen[:,1], chosen[:,0])
+    dst = np.where(flip, chosen[:,0], chosen[:,1])
+    isIntra = rng.random(rows) < intra
+    dst = np.where(isIntra, src, dst)
+    orgs = np.array(['Org %d' % i for i in range(endpoints)], dtype = object)
+    return pd.DataFrame({
+        'src_lat':lat[src],
+        'src_long':long[src],
+        'dst_lat':lat[dst],
+        'dst_long':long[dst],
+        'src_org':orgs[src],
+        'dst_org':orgs[dst],
+        'app':rng.choice(['http','https','ssh','dns'], rows),
+        'dOctets':rng.integers(1, 10**9, rows),
+        'dPkts':rng.integers(1, 10**5, rows)})
+
+def recorder(m, results, traceMemory):
+    """
+    Returns the profileCallbacks function that records the wall time, cpu time and peak traced memory of every stage of m.
+    The traced peak is reset when a top level stage ends, so it covers that stage and the stages nested in it.
+    """
+    def record(name, wall, cpu):
+        stage = results.setdefault(name, {'wall':0.0, 'cpu':0.0})
+        stage['wall'] += wall
+        stage['cpu'] += cpu
+        if traceMemory:
+            stage['peakBytes'] = max(stage.get('peakBytes', 0), tracemalloc.get_traced_memory()[1])
+            if m.stats.depth == 0:
+                tracemalloc.reset_peak()
+    return record
+
+def peakRSS():
+    """
+    Returns the peak resident memory of the process in bytes, or None where it is not available.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak*1024
+
+def directorySize(path):
+    """
+    Returns the size of every file in a directory, 0 if it does not exist.
+    """
+    total = 0
+    for root, dirs, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
+
+def run(df, options, traceMemory):
+    """
+    Builds and saves a map of df with createMap and saveMap, returns the results of the run.
+    """
+    m = ra.Map(df)
+    m.bulkLayers = options.bulk
+    m.lazyPopups = options.lazy
+    m.workers = options.workers
+    if options.plot:
+        m.plotX = 'app'
+        m.plotY = 'dOctets'
+    stages = {}
+    m.profileCallbacks = [recorder(m, stages, traceMemory)]
+    if traceMemory:
+        tracemalloc.start()
+    stats = m.createMap()
+    with tempfile.TemporaryDirectory() as directory:
+        savefile = os.path.join(directory, 'map.html')
+        m.saveMap(savefile)
+        popupBytes = directorySize(os.path.join(directory, 'map_popups'))
+    if traceMemory:
+        tracemalloc.stop()
+    top = [stats.stages[name] for name in stages if not stats.stages[name]['nested']]
+    return {'rows':len(df), 'markers':stats.counters['markers'], 'lines':stats.counters['lines'], 'stages':stages,
+            'wall':sum(s['wall'] for s in top), 'cpu':sum(s['cpu'] for s in top), 'counters':stats.counters,
+            'htmlBytes':stats.counters['htmlBytes'], 'popupBytes':popupBytes, 'peakRSS':peakRSS()}
+
+def version():
+    """
+    Returns the git commit of the benchmarked tree, or None.
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True, text = True,
+                              cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(results, old):
+    """
+    Prints the wall time of every stage against the run with the same amount of rows in an earlier results file.
+    """
+    before = dict((r['rows'], r) for r in old['runs'])
+    for r in results['runs']:
+        if r['rows'] not in before:
+            continue
+        print('%d rows against %s' % (r['rows'], old.get('commit')))
+        for name in list(r['stages']) + ['total']:
+            new = r['wall'] if name == 'total' else r['stages'][name]['wall']
+            prev = before[r['rows']]['wall'] if name == 'total' else before[r['rows']]['stages'].get(name, {}).get('wall')
+            if prev:
+                print('  %-14s %9.3f s %9.3f s %7.2fx' % (name, prev, new, new/prev))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Times every stage of building and saving a map of synthetic flows.')
+    parser.add_argument('--rows', type = int, nargs = '+', default = [1000, 10000, 100000])
+    parser.add_argument('--endpoints', type = int, default = 200)
+    parser.add_argument('--edges', type = int, default = 2000)
+    parser.add_argument('--intra', type = float, default = 0.2)
+    parser.add_argument('--skew', type = float, default = 1.0)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--plot', action = 'store_true', help = 'Draw popup plots')
+    parser.add_argument('--bulk', action = 'store_true', help = 'Use bulkLayers')
+    parser.add_argument('--lazy', action = 'store_true', help = 'Use lazyPopups')
+    parser.add_argument('--workers', type = int, default = None, help = 'Render plots with this many processes')
+    parser.add_argument('--no-memory', action = 'store_true', help = 'Do not trace memory, tracing slows stages down')
+    parser.add_argument('--output', default = 'createmap.json')
+    parser.add_argument('--compare', default = None, help = 'Results file of an earlier run to compare with')
+    options = parser.parse_args()
+    results = {'commit':version(), 'python':platform.python_version(), 'pandas':pd.__version__, 'numpy':np.__version__,
+               'config':dict((k, v) for k, v in vars(options).items() if k not in ['output','compare']), 'runs':[]}
+    for rows in options.rows:
+        df = flows(rows, options.endpoints, options.edges, options.intra, options.skew, options.seed)
+        result = run(df, options, not options.no_memory)
+        results['runs'].append(result)
+        print('%9d rows %6d markers %6d lines %9.3f s %12d html bytes' % (rows, result['markers'], result['lines'], result['wall'], result['htmlBytes']))
+        for name, s in result['stages'].items():
+            print('  %-14s %9.3f s wall %9.3f s cpu %14s' % (name, s['wall'], s['cpu'], '%d peak bytes' % s['peakBytes'] if 'peakBytes' in s else ''))
+    with open(options.output, 'w') as f:
+        json.dump(results, f, indent = 2)
+    print('Results written to %s' % options.output)
+    if options.compare != None:
+        with open(options.compare) as f:
+            compare(results, json.load(f))
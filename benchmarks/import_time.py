@@ -0,0 +1,71 @@
+"""
+Import time check of the ra package.
+Imports ra in fresh interpreters, reports the import time and fails (exit status 1) if it is over a budget,
+if matplotlib or seaborn are imported before a plot is drawn or if a folium map is made before rendering starts.
+
+Usage: python benchmarks/import_time.py [--runs 5] [--budget SECONDS]
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+DEFERRED = ['matplotlib', 'seaborn']
+
+CHECK = """
+import sys, time, json
+start = time.perf_counter()
+import ra
+seconds = time.perf_counter() - start
+import pandas as pd
+m = ra.Map(pd.DataFrame({'src_lat':[1.0], 'src_long':[2.0], 'dst_lat':[3.0], 'dst_long':[4.0]}))
+print(json.dumps({'seconds':seconds, 'modules':sorted(set(k.split('.')[0] for k in sys.modules)), 'map':m._m is not None}))
+"""
+
+def importTimes(module = 'ra'):
+    """
+    Returns the cumulative import time in seconds of every module imported by import module, from python -X importtime.
+    """
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' % module], capture_output = True, text = True, cwd = ROOT).stderr
+    times = {}
+    for line in out.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            own, cumulative, name = line[len('import time:'):].split('|')
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)/1e6
+    return times
+
+def check(runs):
+    """
+    Imports ra in runs fresh interpreters, returns the import times and the problems found.
+    """
+    seconds = []
+    problems = []
+    for i in range(runs):
+        result = json.loads(subprocess.run([sys.executable, '-c', CHECK], capture_output = True, text = True, cwd = ROOT, check = True).stdout)
+        seconds.append(result['seconds'])
+    for name in DEFERRED:
+        if name in result['modules']:
+            problems.append('%s is imported by import ra' % name)
+    if result['map']:
+        problems.append('A folium map is made before rendering starts')
+    return seconds, problems
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Checks the import time of ra.')
+    parser.add_argument('--runs', type = int, default = 5)
+    parser.add_argument('--budget', type = float, default = None, help = 'Fail if the fastest import takes longer than this many seconds')
+    options = parser.parse_args()
+    seconds, problems = check(options.runs)
+    print('import ra: %.3f s fastest, %.3f s slowest of %d runs' % (min(seconds), max(seconds), len(seconds)))
+    times = importTimes()
+    for name, cumulative in sorted(times.items(), key = lambda t: -t[1])[:10]:
+        print('  %-30s %8.3f s' % (name, cumulative))
+    if options.budget != None and min(seconds) > options.budget:
+        problems.append('import ra took %.3f s, the budget is %.3f s' % (min(seconds), options.budget))
+    for problem in problems:
+        print('FAIL: %s' % problem)
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,120 @@
+"""
+Check of the LogoResolver against a local HTTP server.
+Serves logos that answer HEAD, refuse HEAD (405 and 501, checked again with a one byte range request),
+do not exist (404), fail on the server (503) or answer slowly, and checks the results, the requests sent,
+deduplication, the ttl and failureTtl of the cache and that slow logos are checked concurrently.
+Fails (exit status 1) if any check does not pass.
+
+Usage: python benchmarks/logo_resolver.py
+"""
+
+import os
+import sys
+import time
+import socket
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ra.logos import LogoResolver
+
+HEAD = {'/ok.png':200, '/slow.png':200, '/nohead405.png':405, '/nohead501.png':501, '/missing.png':404, '/error.png':503}
+GET = {'/ok.png':200, '/slow.png':200, '/nohead405.png':206, '/nohead501.png':206, '/missing.png':404, '/error.png':503}
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Answers with the status of the path for the method and records every request (method, path, range) in server.seen.
+    """
+    def answer(self, status):
+        path = self.path.split('?')[0]
+        with self.server.lock:
+            self.server.seen.append((self.command, path, self.headers.get('Range')))
+        if path == '/slow.png':
+            time.sleep(0.2)
+        self.send_response(status)
+        self.send_header('Content-Length', '1' if status == 206 else '0')
+        self.end_headers()
+        if self.command == 'GET' and status == 206:
+            self.wfile.write(b'x')
+
+    def do_HEAD(self):
+        self.answer(HEAD.get(self.path.split('?')[0], 404))
+
+    def do_GET(self):
+        self.answer(GET.get(self.path.split('?')[0], 404))
+
+    def log_message(self, *args):
+        pass
+
+def closedPort():
+    """
+    Returns a local port nothing listens on.
+    """
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def check(failures, name, ok):
+    """
+    Prints the outcome of a check and keeps the failed ones.
+    """
+    print('%-4s %s' % ('ok' if ok else 'FAIL', name))
+    if not ok:
+        failures.append(name)
+
+if __name__ == '__main__':
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.seen = []
+    server.lock = threading.Lock()
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    base = 'http://127.0.0.1:%d' % server.server_address[1]
+    url = dict((name, base + '/' + name + '.png') for name in ['ok','nohead405','nohead501','missing','error'])
+    unreachable = 'http://127.0.0.1:%d/logo.png' % closedPort()
+    failures = []
+
+    resolver = LogoResolver(timeout = 2)
+    result = resolver.resolve([url['ok'], url['ok'], url['nohead405'], url['nohead501'], url['missing'], url['error'], 'data:image/png;base64,AAA'])
+    check(failures, 'HEAD 200 is valid', result[url['ok']] == True)
+    check(failures, 'HEAD 405 falls back to a range GET', result[url['nohead405']] == True and
+          ('GET', '/nohead405.png', 'bytes=0-0') in server.seen)
+    check(failures, 'HEAD 501 falls back to a range GET', result[url['nohead501']] == True and
+          ('GET', '/nohead501.png', 'bytes=0-0') in server.seen)
+    check(failures, '404 is invalid', result[url['missing']] == False)
+    check(failures, '503 is invalid', result[url['error']] == False)
+    check(failures, 'data: urls are valid without a request', result['data:image/png;base64,AAA'] == True)
+    check(failures, 'Duplicate urls are checked once', [s[1] for s in server.seen].count('/ok.png') == 1)
+    check(failures, 'No full GET is sent', all(s[0] == 'HEAD' or s[2] == 'bytes=0-0' for s in server.seen))
+    check(failures, 'requests counts every request sent', resolver.requests == len(server.seen) == 7)
+
+    before = resolver.requests
+    resolver.resolve(list(url.values()))
+    check(failures, 'Checked urls are taken from the cache', resolver.requests == before)
+
+    resolver = LogoResolver(ttl = 0.3, timeout = 2)
+    resolver.resolve([url['ok']])
+    time.sleep(0.4)
+    resolver.resolve([url['ok']])
+    check(failures, 'Urls are checked again after ttl', resolver.requests == 2)
+
+    resolver = LogoResolver(ttl = 3600, failureTtl = 0.3, timeout = 2)
+    result = resolver.resolve([url['missing'], url['error'], unreachable])
+    check(failures, 'Unreachable web-servers are invalid', result[unreachable] == False)
+    before = resolver.requests
+    resolver.resolve([url['missing'], url['error'], unreachable])
+    check(failures, 'Failures are cached within failureTtl', resolver.requests == before)
+    time.sleep(0.4)
+    server.seen.clear()
+    resolver.resolve([url['missing'], url['error'], unreachable])
+    check(failures, 'Server errors are checked again after failureTtl', [s[1] for s in server.seen] == ['/error.png'])
+    check(failures, 'Unreachable web-servers are checked again after failureTtl', resolver.requests == before + 2)
+
+    resolver = LogoResolver(workers = 8, timeout = 2)
+    start = time.perf_counter()
+    resolver.resolve(['%s/slow.png?%d' % (base, i) for i in range(16)])
+    seconds = time.perf_counter() - start
+    check(failures, 'Slow urls are checked concurrently (%.2f s for 16 x 0.2 s)' % seconds, seconds < 16*0.2/2)
+
+    server.shutdown()
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,52 @@
+"""
+Benchmark of the popup table renderer against the DataFrame.to_html path it replaced.
+Renders the popup tables of many small groups of flows with both and checks they produce the same markup.
+
+Usage: python benchmarks/popup_tables.py [groups] [rows per popup]
+"""
+
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ra import tables
+
+def flows(groups, rows):
+    """
+    Creates a dataframe of random flows with popup sized groups of rows.
+    """
+    rng = np.random.default_rng(0)
+    n = groups*rows
+    return pd.DataFrame({
+        'src_as':rng.integers(1, 65000, n),
+        'dst_as':rng.integers(1, 65000, n),
+        'src_org':['Org %d' % i for i in rng.integers(0, 500, n)],
+        'dst_org':['Org %d' % i for i in rng.integers(0, 500, n)],
+        'src_logo':['<img src="http://example.com/%d.png" height="50" width="50">' % i for i in rng.integers(0, 500, n)],
+        'app':rng.choice(['http','https','ssh','dns'], n),
+        'dOctets':rng.integers(1, 10**9, n),
+        'duration':np.round(rng.exponential(30, n), 3)})
+
+def timeit(name, function):
+    start = time.perf_counter()
+    result = function()
+    print('%-30s %8.3f s' % (name, time.perf_counter() - start))
+    return result
+
+if __name__ == '__main__':
+    groups = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    pd.set_option('display.max_colwidth', None)
+    df = flows(groups, rows)
+    positions = dict((g, np.arange(g*rows, (g + 1)*rows)) for g in range(groups))
+    frames = [df.iloc[p] for p in positions.values()]
+    print('%d popup tables of %d rows' % (groups, rows))
+    legacy = timeit('DataFrame.to_html + replace', lambda: [tables.legacyTable(f) for f in frames])
+    single = timeit('renderTable', lambda: [tables.renderTable(f) for f in frames])
+    batch = timeit('renderTables (batch)', lambda: tables.renderTables(df, positions))
+    if legacy != single or legacy != [batch[g] for g in positions]:
+        sys.exit('Rendered tables do not match')
+    print('Rendered tables match')
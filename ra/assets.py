@@ -0,0 +1,64 @@
+"""
+Shared assets for saved Ra maps.
+Images embedded as data: urls are written to the map once as a stylesheet and markers and popups refer to them by id,
+instead of repeating the image in every marker icon and popup table cell.
+"""
+
+import re
+
+IMG = re.compile(r'<img\b[^>]*?\bsrc\s*=\s*"(data:[^"]*)"[^>]*>', re.IGNORECASE)
+SIZE = re.compile(r'\b(width|height)\s*=\s*"?(\d+)', re.IGNORECASE)
+
+class AssetTable():
+    """
+    AssetTable gives every distinct data: url an id and renders the stylesheet that holds them.
+    """
+    def __init__(self):
+        self.ids = {}
+
+    def add(self, uri):
+        """
+        Adds a data: url to the table and returns its css class.
+        """
+        if uri not in self.ids:
+            self.ids[uri] = 'ra-asset-%d' % len(self.ids)
+        return self.ids[uri]
+
+    def icon(self, uri, size):
+        """
+        Returns the html of a marker icon that shows the asset for uri.
+        """
+        return '<div class="ra-asset %s" style="width:%dpx;height:%dpx;"></div>' % (self.add(uri), size[0], size[1])
+
+    def rewrite(self, html):
+        """
+        Replaces every img tag with a data: url in html by an element that shows the shared asset.
+        """
+        def replace(match):
+            size = dict((k.lower(), int(v)) for k, v in SIZE.findall(match.group(0)))
+            style = 'display:inline-block;'
+            if 'width' in size:
+                style += 'width:%dpx;' % size['width']
+            if 'height' in size:
+                style += 'height:%dpx;' % size['height']
+            return '<span class="ra-asset %s" style="%s"></span>' % (self.add(match.group(1)), style)
+        return IMG.sub(replace, html)
+
+    def stylesheet(self):
+        """
+        Returns the css with every asset in the table.
+        """
+        rules = ['.ra-asset{background-size:contain;background-repeat:no-repeat;background-position:center;}',
+                 '.ra-popup{width:100%;height:100%;overflow:auto;}']
+        for uri, name in self.ids.items():
+            rules.append('.%s{background-image:url("%s");}' % (name, uri.replace('"','%22')))
+        return '\n'.join(rules)
+
+    def css(self):
+        """
+        Returns the stylesheet with every asset in the table as a style tag.
+        """
+        return '<style>' + self.stylesheet() + '</style>'
+
+    def __len__(self):
+        return len(self.ids)
@@ -0,0 +1,98 @@
+"""
+Batch rendering of Ra maps.
+The flows of a map are split into partitions (one per value of a partition key or one per focus query) that are built
+and saved as separate maps, on the main thread or in a process pool. The settings, location ids, aggregate centroids
+and checked logos of the map are sent to every worker process once instead of being made again for every map.
+"""
+
+import time
+import itertools
+import traceback
+from types import MethodType
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+shared = None
+
+def setShared(state):
+    """
+    Keeps the (class, state, methods) of the map every job of a batch is made from.
+    """
+    global shared
+    shared = state
+
+def renderMap(job):
+    """
+    Builds and saves the map of a single (key, df, savefile) job from the shared map state.
+    Returns a dictionary with the savefile, rows, seconds and error (the traceback if the map failed, otherwise None).
+    """
+    key, df, savefile = job
+    start = time.perf_counter()
+    try:
+        cls, state, methods = shared
+        m = object.__new__(cls)
+        m.__dict__.update(state)
+        for name, method in methods.items():
+            setattr(m, name, MethodType(method, m))
+        m.df = df
+        m.reset()
+        m.createMap()
+        m.saveMap(savefile)
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+    return {'savefile':savefile, 'rows':len(df), 'seconds':time.perf_counter() - start, 'error':error}
+
+def failed(job, error):
+    """
+    Returns the result of a job that could not be run.
+    """
+    key, df, savefile = job
+    return {'savefile':savefile, 'rows':len(df), 'seconds':None, 'error':error}
+
+def renderMaps(jobs, total, state, workers = None, progress = None):
+    """
+    Builds and saves the maps of (key, df, savefile) jobs and returns a dictionary of key: result.
+    jobs: Iterable of jobs, only about two jobs per worker are sliced out and queued at a time.
+    total: The amount of jobs, passed on to progress.
+    state: The (class, state, methods) of the map every job is made from, must be picklable when workers are used.
+    workers: Number of worker processes to render with. Default = None (Render on the main thread)
+    progress: Function called as progress(done, total, key, result) when a map is done. Default = None
+    A map that fails does not stop the batch, its result holds the error.
+    """
+    results = {}
+    def finish(key, result):
+        results[key] = result
+        if progress != None:
+            progress(len(results), total, key, result)
+    if workers == None or workers <= 1 or total <= 1:
+        setShared(state)
+        try:
+            for job in jobs:
+                finish(job[0], renderMap(job))
+        finally:
+            setShared(None)
+        return results
+    jobs = iter(jobs)
+    pending = {}
+    exhausted = False
+    with ProcessPoolExecutor(max_workers = workers, initializer = setShared, initargs = (state,)) as pool:
+        while not exhausted or len(pending) > 0:
+            free = 2*workers - len(pending)
+            queue = list(itertools.islice(jobs, free))
+            exhausted = exhausted or len(queue) < free
+            for job in queue:
+                try:
+                    pending[pool.submit(renderMap, job)] = job
+                except Exception:
+                    finish(job[0], failed(job, traceback.format_exc()))
+            if len(pending) == 0:
+                continue
+            done, running = wait(pending, return_when = FIRST_COMPLETED)
+            for future in done:
+                job = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception:
+                    result = failed(job, traceback.format_exc())
+                finish(job[0], result)
+    return results
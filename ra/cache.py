@@ -0,0 +1,170 @@
+"""
+Content addressed cache for popup plots.
+Plots are keyed by a hash of the flows being plotted and the plot settings, so unchanged plots are not rendered again
+when a map is regenerated.
+"""
+
+import os
+import hashlib
+import pandas as pd
+from collections import OrderedDict
+
+def codeKey(code):
+    """
+    Returns the bytecode and constants of a code object (and the code objects it contains) as text without addresses.
+    """
+    consts = [codeKey(c) if hasattr(c, 'co_code') else repr(c) for c in code.co_consts]
+    return '%s%r%r' % (code.co_code.hex(), consts, code.co_names)
+
+def callableKey(value):
+    """
+    Returns the text a callable setting (e.g. plotEstimator) is hashed as, or None if it can not be identified across runs.
+    Functions are identified by their name, code and defaults, so lambdas with different bodies get different keys.
+    Closures, functools.partial and other callable objects return None since what they compute is not in their code.
+    """
+    name = getattr(value, '__module__', None), getattr(value, '__qualname__', None)
+    if None in name:
+        return None
+    code = getattr(value, '__code__', None)
+    if code is None:
+        return '%s.%s' % name
+    if getattr(value, '__closure__', None) is not None:
+        return None
+    return '%s.%s:%s:%r' % (name + (codeKey(code), getattr(value, '__defaults__', None)))
+
+class PlotCache():
+    """
+    PlotCache keeps rendered popup plots (SVG text) in an in-memory LRU tier and an optional on-disk tier.
+    Can be shared by several maps by setting the plotCache of each map to the same instance.
+
+    PlotCache Parameters:
+        maxsize: The amount of plots kept in memory. Default = 1024
+        path: Directory for the on-disk tier. Default = None (Memory only)
+        maxBytes: Size in bytes the on-disk tier is trimmed to, least recently used plots are removed first. Default = 100MB
+
+    Counters:
+        hits: Plots found in memory.
+        diskHits: Plots found on disk.
+        misses: Plots that had to be rendered.
+    """
+    def __init__(self, maxsize = 1024, path = None, maxBytes = 100*2**20):
+        self.maxsize = maxsize
+        self.path = path
+        self.maxBytes = maxBytes
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.diskHits = 0
+        self.misses = 0
+        self.diskBytes = 0
+        if self.path != None:
+            os.makedirs(self.path, exist_ok = True)
+            self.diskBytes = sum(size for size, mtime, name in self.diskFiles())
+
+    def key(self, df, settings):
+        """
+        Creates the key of a plot from the flows to plot and the plot settings.
+        Returns None if the flows or a callable setting can not be hashed, those plots are not cached.
+        """
+        digest = hashlib.sha256()
+        try:
+            digest.update(pd.util.hash_pandas_object(df, index = False).to_numpy().tobytes())
+        except TypeError:
+            return None
+        digest.update(repr([(str(c), str(t)) for c, t in df.dtypes.items()]).encode())
+        for name in sorted(settings):
+            value = settings[name]
+            if callable(value):
+                value = callableKey(value)
+                if value is None:
+                    return None
+            digest.update(('%s=%r;' % (name, value)).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Returns the cached plot for key, or None if it is not cached.
+        """
+        if key == None:
+            return None
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return self.memory[key]
+        if self.path != None:
+            filename = os.path.join(self.path, key + '.svg')
+            try:
+                with open(filename, encoding = 'utf-8') as f:
+                    svg = f.read()
+                os.utime(filename)
+            except OSError:
+                svg = None
+            if svg != None:
+                self.diskHits += 1
+                self.remember(key, svg)
+                return svg
+        self.misses += 1
+        return None
+
+    def put(self, key, svg):
+        """
+        Stores a rendered plot under key in memory and, if a path was given, on disk.
+        """
+        if key == None:
+            return
+        self.remember(key, svg)
+        if self.path != None:
+            filename = os.path.join(self.path, key + '.svg')
+            if not os.path.exists(filename):
+                with open(filename, 'w', encoding = 'utf-8') as f:
+                    f.write(svg)
+                self.diskBytes += os.path.getsize(filename)
+                if self.diskBytes > self.maxBytes:
+                    self.evict()
+
+    def remember(self, key, svg):
+        """
+        Adds a plot to the in-memory tier, dropping the least recently used plot if it is full.
+        """
+        self.memory[key] = svg
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.maxsize:
+            self.memory.popitem(last = False)
+
+    def diskFiles(self):
+        """
+        Returns (size, mtime, name) of every plot in the on-disk tier.
+        """
+        files = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.svg') and entry.is_file():
+                stat = entry.stat()
+                files.append((stat.st_size, stat.st_mtime, entry.name))
+        return files
+
+    def evict(self):
+        """
+        Removes the least recently used plots from disk until the on-disk tier fits in maxBytes.
+        """
+        files = sorted(self.diskFiles(), key = lambda f: f[1])
+        self.diskBytes = sum(f[0] for f in files)
+        for size, mtime, name in files:
+            if self.diskBytes <= self.maxBytes:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                continue
+            self.diskBytes -= size
+
+    def clear(self):
+        """
+        Empties both tiers and resets the counters.
+        """
+        self.memory.clear()
+        if self.path != None:
+            for size, mtime, name in self.diskFiles():
+                os.remove(os.path.join(self.path, name))
+        self.diskBytes = 0
+        self.hits = 0
+        self.diskHits = 0
+        self.misses = 0
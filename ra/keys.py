@@ -0,0 +1,81 @@
+"""
+Location and edge keys shared by Ra maps and flow summaries.
+Locations are matched on quantized integer ids instead of float equality on lat/long pairs:
+every coordinate is rounded to a number of decimals and the pair is packed into one int64,
+so grouping, joining and comparing locations works on integers and coordinates that only differ
+past the precision (e.g. 33.64070000001 and 33.6407) are the same location.
+Longitudes are wrapped into [-180, 180) (so 0-360 longitudes work), locations with a missing (NaN) or infinite coordinate
+or a latitude outside [-90, 90] get the MISSING id, flows with a MISSING end are left out of maps.
+"""
+
+import numpy as np
+
+SRC = 'ra_src'
+DST = 'ra_dst'
+IDS = [SRC, DST]
+MISSING = -1
+
+def locationIds(lat, long, precision = 6):
+    """
+    Returns the int64 id of every lat, long pair rounded to precision decimals (at most 7).
+    Longitudes are wrapped into [-180, 180), pairs with a coordinate that is not finite or a latitude outside [-90, 90] get MISSING.
+    Ids sort in the same order as the rounded (lat, long) pairs with wrapped longitudes.
+    """
+    if precision < 0 or precision > 7:
+        raise ValueError('Location precision has to be between 0 and 7 decimals')
+    scale = 10**precision
+    lat = np.asarray(lat, dtype = float)
+    long = np.asarray(long, dtype = float)
+    valid = np.isfinite(lat) & np.isfinite(long) & (np.abs(np.where(np.isfinite(lat), lat, 0)) <= 90)
+    latQ = np.round(np.where(valid, lat, 0)*scale).astype('int64') + 90*scale
+    long = np.mod(np.where(valid, long, 0) + 180.0, 360.0)
+    longQ = np.mod(np.round(long*scale).astype('int64'), 360*scale)
+    return np.where(valid, latQ*(360*scale + 1) + longQ, MISSING)
+
+def locations(ids, precision = 6):
+    """
+    Returns the rounded lat and long arrays of location ids made by locationIds with the same precision.
+    """
+    scale = 10**precision
+    lat, long = np.divmod(np.asarray(ids, dtype = 'int64'), 360*scale + 1)
+    return (lat - 90*scale)/scale, (long - 180*scale)/scale
+
+def locationKeys(ids, precision = 6):
+    """
+    Returns the (lat, long) tuple of every location id, the key markers are made and drawn with.
+    """
+    lat, long = locations(ids, precision)
+    return list(zip(lat.tolist(), long.tolist()))
+
+def addLocationIds(df, precision = 6):
+    """
+    Adds the src and dst location id columns (ra_src and ra_dst) to df.
+    """
+    df[SRC] = locationIds(df['src_lat'].to_numpy(), df['src_long'].to_numpy(), precision)
+    df[DST] = locationIds(df['dst_lat'].to_numpy(), df['dst_long'].to_numpy(), precision)
+
+def located(df):
+    """
+    Returns a boolean array of the flows in df whose src and dst locations both have an id (are not MISSING).
+    """
+    return (df[SRC].to_numpy() != MISSING) & (df[DST].to_numpy() != MISSING)
+
+def edgeIds(df, directed = False):
+    """
+    Creates the canonical undirected key (ordered endpoint pair) of every flow in df from its location ids.
+    Returns (low, high, forward): the smaller and larger endpoint id and whether the flow goes from low to high.
+    With directed the key is simply (src, dst).
+    """
+    src = df[SRC].to_numpy()
+    dst = df[DST].to_numpy()
+    if directed:
+        return src, dst, np.ones(len(src), dtype = bool)
+    return np.minimum(src, dst), np.maximum(src, dst), src <= dst
+
+def edgeKeys(low, high, precision = 6):
+    """
+    Returns the (lat1, long1, lat2, long2) tuple of every edge given by its endpoint ids, the key lines are made and drawn with.
+    """
+    lat1, long1 = locations(low, precision)
+    lat2, long2 = locations(high, precision)
+    return list(zip(lat1.tolist(), long1.tolist(), lat2.tolist(), long2.tolist()))
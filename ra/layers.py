@@ -0,0 +1,96 @@
+"""
+Bulk rendering layers for Ra maps.
+Every marker or every line of a map is written as one GeoJSON FeatureCollection drawn by a single Leaflet layer,
+styled from the properties of each feature, instead of one folium object (and one block of javascript) per marker and line.
+"""
+
+import json
+from branca.element import MacroElement, Figure, JavascriptLink, CssLink
+from jinja2 import Template
+
+CLUSTER_JS = [('markerclusterjs', 'https://cdnjs.cloudflare.com/ajax/libs/leaflet.markercluster/1.1.0/leaflet.markercluster.js')]
+CLUSTER_CSS = [('markerclustercss', 'https://cdnjs.cloudflare.com/ajax/libs/leaflet.markercluster/1.1.0/MarkerCluster.css'),
+               ('markerclusterdefaultcss', 'https://cdnjs.cloudflare.com/ajax/libs/leaflet.markercluster/1.1.0/MarkerCluster.Default.css')]
+
+class FeatureLayer(MacroElement):
+    """
+    Draws a list of GeoJSON features on the map as one layer.
+    Feature properties used:
+        popup: Html of the popup of the feature.
+        style: Leaflet path options of a line (color, opacity, weight).
+        icon: Url of the marker icon image, or iconHtml: Html of the marker icon.
+    cluster: Group nearby markers into clusters (Leaflet.markercluster). Default = False
+    """
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = L.geoJSON({{ this.dumps() }}, {
+                style: function(feature) {
+                    return feature.properties.style || {};
+                },
+                pointToLayer: function(feature, latlng) {
+                    var p = feature.properties;
+                    if (p.icon) {
+                        return L.marker(latlng, {icon: L.icon({iconUrl: p.icon, iconSize: [40, 40], popupAnchor: [0, -20]})});
+                    }
+                    if (p.iconHtml) {
+                        return L.marker(latlng, {icon: L.divIcon({html: p.iconHtml, className: '', iconSize: [40, 40], iconAnchor: [20, 20], popupAnchor: [0, -20]})});
+                    }
+                    return L.marker(latlng);
+                },
+                onEachFeature: function(feature, layer) {
+                    if (feature.properties.popup) {
+                        layer.bindPopup(feature.properties.popup, {maxWidth: 2650});
+                    }
+                }
+            });
+            {% if this.cluster %}
+            L.markerClusterGroup().addLayer({{ this.get_name() }}).addTo({{ this._parent.get_name() }});
+            {% else %}
+            {{ this.get_name() }}.addTo({{ this._parent.get_name() }});
+            {% endif %}
+        {% endmacro %}
+        """)
+
+    def __init__(self, features, cluster = False):
+        super().__init__()
+        self._name = 'FeatureLayer'
+        self.data = {'type':'FeatureCollection','features':features}
+        self.cluster = cluster
+
+    def dumps(self):
+        """
+        Returns the FeatureCollection as compact json that can be put in a script tag.
+        """
+        return json.dumps(self.data, separators = (',',':')).replace('</', '<\\/')
+
+    def render(self, **kwargs):
+        """
+        Adds the Leaflet.markercluster scripts to the page if the layer is clustered, then renders the layer.
+        """
+        if self.cluster:
+            figure = self.get_root()
+            if isinstance(figure, Figure):
+                for name, url in CLUSTER_JS:
+                    figure.header.add_child(JavascriptLink(url), name = name)
+                for name, url in CLUSTER_CSS:
+                    figure.header.add_child(CssLink(url), name = name)
+        super().render(**kwargs)
+
+def marker(location, popup, icon = None, iconHtml = None):
+    """
+    Returns the GeoJSON feature of a marker at location [lat, long].
+    """
+    properties = {'popup':popup}
+    if icon != None:
+        properties['icon'] = icon
+    if iconHtml != None:
+        properties['iconHtml'] = iconHtml
+    return {'type':'Feature','geometry':{'type':'Point','coordinates':[float(location[1]), float(location[0])]},'properties':properties}
+
+def line(location1, location2, popup, style):
+    """
+    Returns the GeoJSON feature of a line between two [lat, long] locations.
+    style: Dictionary of Leaflet path options.
+    """
+    coordinates = [[float(location1[1]), float(location1[0])], [float(location2[1]), float(location2[0])]]
+    return {'type':'Feature','geometry':{'type':'LineString','coordinates':coordinates},'properties':{'popup':popup,'style':style}}
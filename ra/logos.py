@@ -0,0 +1,113 @@
+"""
+Logo validation for Ra maps.
+Logo urls are deduplicated and checked concurrently without downloading the images, results are cached for a while
+so maps built back to back do not check the same logo again.
+"""
+
+import time
+import threading
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+class LogoResolver():
+    """
+    LogoResolver checks if logo urls can be reached, using HEAD requests (or a one byte range request if HEAD is refused).
+
+    LogoResolver Parameters:
+        ttl: Seconds a checked url is remembered for. Default = 3600
+        failureTtl: Seconds a url whose web-server could not be reached (timeout, DNS or connection error, 5xx answer) is remembered for,
+            so a network blip does not hide a logo for the full ttl. Default = 60
+        workers: The most urls that are checked at the same time. Default = 8
+        timeout: Seconds to wait for a web-server to answer. Default = 5
+
+    Counters:
+        requests: Requests sent to web-servers.
+    """
+    def __init__(self, ttl = 3600, workers = 8, timeout = 5, failureTtl = 60):
+        self.ttl = ttl
+        self.failureTtl = failureTtl
+        self.workers = workers
+        self.timeout = timeout
+        self.cache = {}
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        """
+        Drops the lock, so a resolver and its cache can be sent to worker processes.
+        """
+        state = dict(self.__dict__)
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def request(self, url, method, headers = {}):
+        """
+        Sends a single request for url without reading the response body.
+        """
+        with self.lock:
+            self.requests += 1
+        req = urllib.request.Request(url, method = method, headers = headers)
+        with urllib.request.urlopen(req, timeout = self.timeout):
+            pass
+
+    def check(self, url):
+        """
+        Returns True if url can be reached, False if the web-server refused it (or it is not a valid url)
+        and None if the web-server could not be reached or answered with a server error. data: urls are always valid.
+        """
+        if url.startswith('data:'):
+            return True
+        try:
+            try:
+                self.request(url, 'HEAD')
+            except urllib.error.HTTPError as e:
+                if e.code not in (405, 501):
+                    raise
+                self.request(url, 'GET', {'Range':'bytes=0-0'})
+            return True
+        except urllib.error.HTTPError as e:
+            return None if e.code >= 500 else False
+        except ValueError:
+            return False
+        except (urllib.error.URLError, OSError):
+            return None
+
+    def resolve(self, urls):
+        """
+        Checks a list of urls and returns a dictionary of url: True/False.
+        Every url is only checked once, urls checked within ttl seconds (failureTtl seconds for unreachable web-servers)
+        are taken from the cache.
+        """
+        now = time.time()
+        result = {}
+        pending = []
+        with self.lock:
+            for url in set(urls):
+                if url in self.cache and self.cache[url][1] > now:
+                    result[url] = self.cache[url][0]
+                else:
+                    pending.append(url)
+        if len(pending) > 1 and self.workers > 1:
+            with ThreadPoolExecutor(max_workers = min(self.workers, len(pending))) as pool:
+                checked = list(pool.map(self.check, pending))
+        else:
+            checked = [self.check(url) for url in pending]
+        with self.lock:
+            for url, ok in zip(pending, checked):
+                self.cache[url] = (ok == True, now + (self.ttl if ok != None else self.failureTtl))
+                result[url] = ok == True
+            for url in [u for u in self.cache if self.cache[u][1] <= now]:
+                del self.cache[url]
+        return result
+
+    def clear(self):
+        """
+        Forgets every checked url.
+        """
+        with self.lock:
+            self.cache.clear()
@@ -0,0 +1,74 @@
+"""
+Popup plot rendering for Ra maps.
+Plots can be rendered one at a time on the main thread or collected as jobs and rendered in a process pool.
+matplotlib and seaborn are only imported when the first plot is drawn, so maps without plots
+(and processes that never plot) do not pay for importing them or starting a matplotlib backend.
+"""
+
+from io import StringIO
+from concurrent.futures import ProcessPoolExecutor
+
+styled = False
+
+def setStyle():
+    """
+    Applies the plot style used for every popup plot, when the next plot is drawn.
+    """
+    global styled
+    styled = False
+
+def pyplot():
+    """
+    Imports matplotlib.pyplot and seaborn, applies the plot style if it is not applied yet and returns (plt, sns).
+    """
+    global styled
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    if not styled:
+        sns.set(font_scale = 1.25)
+        styled = True
+    return plt, sns
+
+def plotSVG(df, settings):
+    """
+    Creates plot for popup and returns it as SVG text.
+    df: Pandas dataframe with the flows to plot.
+    settings: Dictionary with the plotType, plotX, plotY, plotHue, plotEstimator and plotCI of the map.
+    """
+    plt, sns = pyplot()
+    try:
+        fig, ax = plt.subplots()
+        fig = plt.figure()
+        if settings['plotType'] == 'scatter':
+            sns.scatterplot(x = settings['plotX'], y = settings['plotY'], data=df, hue = settings['plotHue'])
+        else:
+            fig = sns.catplot(x = settings['plotX'], y = settings['plotY'], data=df,ci = settings['plotCI'], kind = settings['plotType'], estimator = settings['plotEstimator'])
+        plt.xticks(rotation = 45)
+        plt.tight_layout()
+        svg = StringIO()
+        fig.savefig(svg, format='svg')
+        svgtxt = svg.getvalue()
+        svg.close()
+        plt.close('all')
+        return(svgtxt)
+    except ValueError:
+        plt.close('all')
+        return('')
+
+def renderJob(job):
+    """
+    Renders a single (df, settings) plot job.
+    """
+    return plotSVG(*job)
+
+def renderPlots(jobs, workers = None):
+    """
+    Renders a list of (df, settings) plot jobs and returns their SVG text in the same order as jobs.
+    workers: Number of worker processes to render with. Default = None (Render on the main thread)
+    The settings, including plotEstimator, must be picklable when workers are used.
+    """
+    if workers == None or workers <= 1 or len(jobs) <= 1:
+        return [renderJob(job) for job in jobs]
+    chunksize = max(1, len(jobs)//(workers*4))
+    with ProcessPoolExecutor(max_workers = workers, initializer = setStyle) as pool:
+        return list(pool.map(renderJob, jobs, chunksize = chunksize))
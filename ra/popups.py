@@ -0,0 +1,53 @@
+"""
+Lazy loaded popups for saved Ra maps.
+Popup content is written next to the map as one small html file per marker or line and is only loaded when the popup is opened.
+"""
+
+import os
+from branca.element import MacroElement
+from jinja2 import Template
+
+class LazyPopups(MacroElement):
+    """
+    Loads the content of lazy popups on the map when they are opened.
+    base: Path of the popup directory relative to the saved map.
+    """
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            {{ this._parent.get_name() }}.on('popupopen', function(e) {
+                var frames = e.popup.getElement().querySelectorAll('iframe[data-ra-popup]');
+                for (var i = 0; i < frames.length; i++) {
+                    if (!frames[i].getAttribute('src')) {
+                        frames[i].setAttribute('src', {{ this.base|tojson }} + frames[i].getAttribute('data-ra-popup'));
+                    }
+                }
+            });
+        {% endmacro %}
+        """)
+
+    def __init__(self, base = ''):
+        super().__init__()
+        self._name = 'LazyPopups'
+        self.base = base
+
+def placeholder(name, width, height):
+    """
+    Returns the html put in a lazy popup on the map, an iframe that is pointed at the popup file when opened.
+    """
+    return '<iframe data-ra-popup="%s.html" width="%s" height="%s" style="border:none !important;"></iframe>' % (name, width, height)
+
+def writePopups(directory, popups, stylesheet = None):
+    """
+    Writes every popup to its own html file in directory.
+    popups: Dictionary of popup name: html.
+    stylesheet: Optional css with the shared assets, written once to assets.css and linked by every popup.
+    """
+    os.makedirs(directory, exist_ok = True)
+    head = '<meta charset="utf-8">'
+    if stylesheet != None:
+        with open(os.path.join(directory, 'assets.css'), 'w', encoding = 'utf-8') as f:
+            f.write(stylesheet)
+        head += '<link rel="stylesheet" href="assets.css">'
+    for name, html in popups.items():
+        with open(os.path.join(directory, name + '.html'), 'w', encoding = 'utf-8') as f:
+            f.write('<!DOCTYPE html><html><head>' + head + '</head><body>' + html + '</body></html>')
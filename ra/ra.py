@@ -10,16 +10,29 @@ By: Christopher Mendoza
 
 import folium
 import pandas as pd
+import numpy as np
 from folium.features import CustomIcon
-import urllib.request
-import matplotlib.pyplot as plt
-import seaborn as sns
-from io import StringIO
+import os
+import re
 from types import MethodType
+from contextlib import nullcontext
+from . import plot
+from . import popups
+from . import tables
+from . import keys
+from . import stream
+from . import layers
+from . import spatial
+from . import batch
+from .cache import PlotCache
+from .logos import LogoResolver
+from .assets import AssetTable
+from .stats import MapStats
 
 class Map():
     """
     Map is a class will create, save and customize point to point visualizations.
+    Every instance has its own folium map (m, created when rendering starts), use reset() or a with block to build maps back to back with the same instance.
     
     Ra Map Customization Parameters:
         popupLen The amount of flows that will appear in a popup. Default = 3
@@ -27,59 +40,219 @@ class Map():
         MarkerInfo: The column names that will appear in the marker popups. Default = None (Shows All)
         getMarkerLogos: Add marker logos to map, will only work if you applied dfAddLogos. Default = False
         logoCheck: Verify if logo is in web-server using url request. Default = True
+        logoResolver: The LogoResolver used to verify logos, shared by every map so checked logos are cached across maps. Default = LogoResolver()
         lineFunction: Color of line that will be drawn (can be dynamically modified using setLineFunction). Default = 'green'
         lineOpacity: Opacity of line that will be drawn (can be dynamically modified using lineOptions). Default = 1
+        lineStyle: Function that styles every line at once from the per-line aggregates (set using setLineStyle), used instead of lineFunction. Default = None
+        lineAggregates: The per-line aggregates lineStyle gets, any spec of DataFrameGroupBy.agg. Default = None (Flow count and sum of every numeric column)
+        locationPrecision: The decimals lat and long are rounded to for matching locations, at most 7 (see keys.locationIds). Default = 6
+        directedLines: Draw a separate line for each direction between two locations instead of one shared line. Default = False
+        pruneTop: Only draw the this many lines with the largest pruneWeight. Default = None
+        prunePerNode: Only draw the lines that are among the this many lines with the largest pruneWeight of one of their locations. Default = None
+        pruneThreshold: Only draw the lines with a pruneWeight of at least this. Default = None
+        pruneWeight: The column summed per line to rank lines by for pruning. Default = None (Flow count)
         popupWidth: Will modify the width of the popup, marker popup and line popup can be adjusted seperately. Default = {'marker':1000,'line':1000}
+        shareAssets: Write every distinct data: url logo to the map once and have markers and popups refer to it by id. Default = False
+        lazyPopups: Save popup content to its own file per marker and line, loaded only when the popup is opened. Default = False
+        bulkLayers: Draw every marker and every line as one GeoJSON layer styled from feature properties, instead of one folium object each. Default = False
+        bulkCluster: Cluster nearby markers of the bulk marker layer. Default = False
         plotX: The x-axis variable (name of pandas column) for the plot drawn in the popup. Default = None
         plotY: The y-axis variable (name of pandas column) for the polot drawn in the popup. Default = None
         plotType: Selects the type of plot to draw. Default = 'bar'
         plotHue: Variable (name of pandas column) to adjust hue of points in plot. Default = None
         plotEstimator: The estimator to be used for the plots. Default = sum
         plotCI: Confidence interval for plot. Default = None
+        workers: Render popup plots in a pool of this many processes once all popups are made. Default = None (Render each plot as it is needed)
+        plotCache: A PlotCache used to reuse popup plots whose flows and plot settings have not changed. Default = None
+        profile: Time every stage of createMap and saveMap and count what is made, createMap then returns the MapStats (also kept as stats).
+            Plots drawn while making popups are also timed as the makePlot stage, inside the stage that made the popup. Default = False
+        profileCallbacks: Functions called as callback(name, wall, cpu) when a stage ends, setting them enables profile. Default = None
     """
-    m = folium.Map(location=[0, 0], tiles='OpenStreetMap', zoom_start=2)
     popupLen = 3
     popupOrder = None
     sortVar = None
-    markerList1 = []
-    markerList2 = []
     markerInfo = None
     getMarkerLogos = False
     logoCheck = True
+    logoResolver = LogoResolver()
     lineColor = 'green'
     lineOpacity = 1
     lineFunction = None
-    preserve = []
-    agg_lats = {}
-    agg_longs = {}
+    lineStyle = None
+    lineAggregates = None
+    directedLines = False
+    locationPrecision = 6
+    pruneTop = None
+    prunePerNode = None
+    pruneThreshold = None
+    pruneWeight = None
     popupWidth = {'marker':1000,'line':1000}
+    shareAssets = False
+    lazyPopups = False
+    bulkLayers = False
+    bulkCluster = False
     plotX = None
     plotY = None
     plotType = 'bar'
     plotHue = None
     plotEstimator = sum
     plotCI = None
+    workers = None
+    plotCache = None
+    profile = False
+    profileCallbacks = None
+    summary = None
     
     def __init__(self, df):
         """
         Loads selected dataframe as class dataframe and makes sure it's in the correct format.
         df: Pandas dataframe to set as class dataframe.
+        The map keeps a shallow copy of df, so the columns it adds (location ids, aggregates) are not added to df.
         """
         if 'src_lat' not in list(df) or 'src_long' not in list(df) or  'dst_lat' not in list(df) or 'dst_long' not in list(df):
             raise ValueError('Dataset does not contain correct columns')
         else:
-            self.df = df
+            self.df = df.copy(deep = False)
+            self.idPrecision = None
+            self.locationIds()
+            self.popupWidth = dict(self.popupWidth)
+            self.preserve = []
+            self.agg_lats = {}
+            self.agg_longs = {}
+            self.aggregated = None
+            self.spatialCells = None
+            self.reset()
+
+    def reset(self):
+        """
+        Clears everything made by createMap (the folium map, markers, lines, popups and queued plots) so the instance
+        can build another map without keeping the previous one in memory. Settings and the class dataframe are kept.
+        """
+        self._m = None
+        self.markerList1 = []
+        self.markerList2 = []
+        self.lineList = []
+        self.plotJobs = []
+        self.plotKeys = []
+        self.assets = AssetTable()
+        self.popupFiles = {}
+        self.markerElements = {}
+        self.lineElements = {}
+        self.markerFeatures = {}
+        self.lineFeatures = {}
+        self.markerIds = {}
+        self.lineIds = {}
+        self.keptEdges = None
+        self.pruned = None
+        self.stats = None
+        self.intra = None
+        self.inter = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        """
+        Releases the render state when leaving a with block.
+        """
+        self.reset()
+        return False
             
+    @classmethod
+    def fromChunks(cls, source, chunksize = 100000, readOptions = None, **settings):
+        """
+        Creates a map from a flow dataset that does not fit in memory by streaming it in chunks.
+        Only per-location and per-edge summaries (counts, column sums, the rows shown in popups and plot aggregates)
+        are kept, so memory is bounded by the amount of locations and edges instead of flows.
+        source: Path of a csv or parquet (requires pyarrow) file, or an iterable of dataframes.
+        chunksize: The amount of rows read at a time. Default = 100000
+        readOptions: Dictionary of keyword arguments for pd.read_csv. Default = None
+        settings: Map customization parameters, the popup and plot parameters must be given here since they decide what is kept.
+        Line functions get the flows kept for the popup of the line instead of every flow.
+        """
+        names = ['popupLen','sortVar','markerInfo','plotX','plotY','plotHue','plotType','plotEstimator','directedLines','locationPrecision']
+        summary = stream.FlowSummary(**dict((name, settings.get(name, getattr(cls, name))) for name in names))
+        for chunk in stream.readChunks(source, chunksize, readOptions):
+            if summary.rows == 0 and not set(['src_lat','src_long','dst_lat','dst_long']).issubset(chunk.columns):
+                raise ValueError('Dataset does not contain correct columns')
+            summary.add(chunk)
+        m = cls(summary.flows())
+        for name, value in settings.items():
+            setattr(m, name, value)
+        m.summary = summary
+        return m
+
+    @property
+    def m(self):
+        """
+        The folium map, only created when rendering starts.
+        """
+        if self._m is None:
+            self._m = folium.Map(location=[0, 0], tiles='OpenStreetMap', zoom_start=2)
+        return self._m
+
+    @m.setter
+    def m(self, m):
+        self._m = m
+
+    @property
+    def df(self):
+        """
+        The class dataframe: the original dataframe with every focus filter applied.
+        Filtered rows are only copied out of the original dataframe the first time they are needed.
+        """
+        if len(self.filters) == 0:
+            return self.origdf
+        if self.view is None:
+            self.view = self.origdf[self.filters[-1][1]]
+        return self.view
+
+    @df.setter
+    def df(self, df):
+        self.origdf = df
+        self.filters = []
+        self.view = None
+
+    def locationIds(self):
+        """
+        Adds the quantized location id columns (ra_src and ra_dst) to the original dataframe,
+        unless they are there already and were made with the current locationPrecision.
+        """
+        if keys.SRC not in self.origdf.columns or self.idPrecision != self.locationPrecision:
+            keys.addLocationIds(self.origdf, self.locationPrecision)
+            self.idPrecision = self.locationPrecision
+            self.view = None
+
     def focus(self,op):
         """
-        Filters class dataframe by df.query string given and saves original non-filtered dataframe into origdf.
+        Filters class dataframe by df.query string given, on top of the filters already applied.
+        Filters are kept as boolean masks over the original non-filtered dataframe (origdf), so no rows are copied.
         op: df.query string
         """
-        self.origdf = self.df.copy()
-        self.df = self.df.query(op).copy()
-        if len(self.df) == 0:
-            self.df = self.origdf
+        mask = np.asarray(self.origdf.eval(op), dtype = bool)
+        if len(self.filters) > 0:
+            mask = mask & self.filters[-1][1]
+        if not mask.any():
             raise ValueError('There are no flows found using this filter, dataset has not been changed')
+        self.filters.append((op, mask))
+        self.view = None
+
+    def unfocus(self):
+        """
+        Removes the last filter applied with focus and returns its query string.
+        """
+        if len(self.filters) == 0:
+            raise ValueError('There are no filters to remove')
+        op, mask = self.filters.pop()
+        self.view = None
+        return op
+
+    def clearFocus(self):
+        """
+        Removes every filter applied with focus.
+        """
+        self.filters = []
+        self.view = None
             
     def lineFunction(self,df):
         """
@@ -97,112 +270,411 @@ class Map():
                 return 'red'
         """
         self.lineFunction = MethodType(method, self)
+
+    def setLineStyle(self, method):
+        """
+        Set user defined lineStyle, which styles every line with a single call instead of calling lineFunction once per line.
+        method: user defined function that gets a dataframe with one row per line (lat1, long1, lat2, long2 and the lineAggregates)
+        and returns an array of colors, or a dictionary (or dataframe) of color, opacity and weight arrays with one value per line.
+
+        Example(self,edges):
+            return np.where(edges['bytes'] > 10**6, 'red', 'green')
+        """
+        self.lineStyle = MethodType(method, self)
+
+    def lineStats(self, made):
+        """
+        Computes the aggregates of every line in made (a list of (location1, location2, positions)) in one grouped pass.
+        Maps made with fromChunks use the flow counts and column sums of their FlowSummary unless lineAggregates is set.
+        Returns a dataframe with one row per line.
+        """
+        ends = pd.DataFrame([edge[0] + edge[1] for edge in made], columns = ['lat1','long1','lat2','long2'])
+        if self.summary != None and self.lineAggregates == None:
+            stats = self.summary.stats['edge'].reindex([self.edgeKey(edge[0], edge[1]) for edge in made])
+            return pd.concat([ends, stats.reset_index(drop = True)], axis = 1)
+        label = np.full(len(self.inter), -1)
+        for number, edge in enumerate(made):
+            label[edge[2]] = number
+        flows = self.inter[label >= 0]
+        grouped = flows.groupby(label[label >= 0])
+        if self.lineAggregates == None:
+            numeric = [c for c in flows.select_dtypes('number').columns if not c.endswith('_lat') and not c.endswith('_long') and c not in keys.IDS]
+            stats = grouped[numeric].sum()
+            stats.insert(0, 'count', grouped.size())
+        else:
+            stats = grouped.agg(self.lineAggregates)
+        return pd.concat([ends, stats.reindex(range(len(made))).reset_index(drop = True)], axis = 1)
+
+    def styleLines(self, made):
+        """
+        Returns the color, opacity and weight of every line in made from a single lineStyle call.
+        """
+        style = self.lineStyle(self.lineStats(made))
+        if not isinstance(style, (dict, pd.DataFrame)):
+            style = {'color':style}
+        styles = {}
+        for name, default in [('color', self.lineColor), ('opacity', self.lineOpacity), ('weight', None)]:
+            if name in style:
+                values = np.asarray(style[name]).tolist()
+                if len(values) != len(made):
+                    raise ValueError('lineStyle returned %d %s values for %d lines' % (len(values), name, len(made)))
+            else:
+                values = [default]*len(made)
+            styles[name] = values
+        return styles
     
+    def plotSettings(self):
+        """
+        Returns the plot settings of the map as a dictionary.
+        """
+        return {'plotType':self.plotType,'plotX':self.plotX,'plotY':self.plotY,'plotHue':self.plotHue,'plotEstimator':self.plotEstimator,'plotCI':self.plotCI}
+
     def makePlot(self, df):
         """
         Creates plot for popup.
+        If plotCache is set, plots already rendered with the same flows and settings are reused.
+        If workers is set the plot is queued as a job and a placeholder is returned, renderPlots fills it in later.
         """
-        try:
-            fig, ax = plt.subplots()
-            fig = plt.figure()
-            if self.plotType == 'scatter':
-                sns.scatterplot(self.plotX, self.plotY, data=df, hue = self.plotHue)
-            else:
-                fig = sns.catplot(self.plotX, self.plotY, data=df,ci = self.plotCI, kind = self.plotType, estimator = self.plotEstimator)
-            plt.xticks(rotation = 45)
-            plt.tight_layout()
-            svg = StringIO()
-            fig.savefig(svg, format='svg')
-            svgtxt = svg.getvalue()
-            svg.close()
-            plt.close('all')
-            return(svgtxt) 
-        except ValueError:
-            return('')
-
-    def aggregate(self, column):
+        settings = self.plotSettings()
+        key = None
+        if self.plotCache != None:
+            key = self.plotCache.key(df, settings)
+            svg = self.plotCache.get(key)
+            if svg != None:
+                return svg
+        if self.workers == None:
+            if self.stats is not None:
+                self.stats.count('plots')
+            with self.stage('makePlot'):
+                svg = plot.plotSVG(df, settings)
+            if self.plotCache != None:
+                self.plotCache.put(key, svg)
+            return svg
+        self.plotJobs.append((df, settings))
+        self.plotKeys.append(key)
+        return '<!--ra-plot:%d-->' % (len(self.plotJobs) - 1)
+
+    def renderPlots(self):
+        """
+        Renders every queued plot job, using a pool of workers processes, and puts the plots into the marker and line html.
+        """
+        if len(self.plotJobs) == 0:
+            return
+        if self.stats is not None:
+            self.stats.count('plots', len(self.plotJobs))
+        svgs = plot.renderPlots(self.plotJobs, self.workers)
+        if self.plotCache != None:
+            for key, svg in zip(self.plotKeys, svgs):
+                self.plotCache.put(key, svg)
+        fill = lambda html: re.sub(r'<!--ra-plot:(\d+)-->', lambda match: svgs[int(match.group(1))], html)
+        for marker in self.markerList1 + self.markerList2:
+            if '<!--ra-plot:' in marker['html1']:
+                marker['html1'] = fill(marker['html1'])
+        for line in self.lineList:
+            if '<!--ra-plot:' in line['html']:
+                line['html'] = fill(line['html'])
+        self.plotJobs = []
+        self.plotKeys = []
+
+    def aggregate(self, column, weight = None):
         """
         Aggregates class dataframe by src_column and dst_column.
         To aggregate there must be two columns that only differ in name by src_ and dst_ prefixes.
+        column: Column name without prefix, or a list of them to aggregate on their combination.
+        weight: Optional column name (e.g. bytes) to weight the centroid of each aggregate by. Default = None (Every flow counts the same)
+        Centroids are computed from the focused flows and applied to the original dataframe, so the aggregation is kept by focus and unfocus.
+        Keys that only appear in flows filtered out by focus get the centroid of all their flows.
+        """
+        columns = [column] if isinstance(column, str) else list(column)
+        centroids = self.centroids(columns, weight)
+        if len(self.filters) > 0:
+            centroids = centroids.combine_first(self.centroids(columns, weight, self.origdf))
+        self.moveToCentroids(self.origdf, columns, centroids)
+        self.view = None
+        self.agg_lats.update(centroids['lat'].to_dict())
+        self.agg_longs.update(centroids['long'].to_dict())
+        self.aggregated = (columns, weight)
+
+    def aggregateSpatial(self, mode = 'grid', resolution = None, zoom = 2, weight = None):
+        """
+        Aggregates class dataframe by snapping src and dst locations to spatial cells, every cell becomes one location at the centroid of its flows.
+        The cell of every location is kept in the src_cell and dst_cell columns.
+        mode: 'grid', 'geohash' or 'hex'. Default = 'grid'
+        resolution: Cell size in degrees for grid and hex, number of characters for geohash. Default = None (The resolution for zoom)
+        zoom: The zoom level to pick the resolution for, cells are about 64 pixels wide at that zoom (see spatial.pyramid for every level at once). Default = 2
+        weight: Optional column name (e.g. bytes) to weight the centroid of each cell by. Default = None (Every flow counts the same)
+        """
+        if resolution == None:
+            resolution = spatial.resolution(mode, zoom)
+        self.spatialCells = (mode, resolution)
+        self.addCells(self.origdf)
+        self.aggregate('cell', weight)
+
+    def addCells(self, df):
+        """
+        Adds the src_cell and dst_cell columns of the spatial cells set by aggregateSpatial to df.
+        """
+        mode, resolution = self.spatialCells
+        for prefix in ['src_','dst_']:
+            df[prefix + 'cell'] = spatial.cells(df[prefix + 'lat'].to_numpy(), df[prefix + 'long'].to_numpy(), mode, resolution)
+
+    def moveToCentroids(self, df, columns, centroids):
+        """
+        Moves the src and dst locations of df onto the centroids of their aggregate keys, the original locations are kept in *_na columns.
+        centroids: Dataframe indexed by the aggregate key with lat and long columns.
+        """
+        df['src_lat_na'] = df['src_lat']
+        df['src_long_na'] = df['src_long']
+        df['dst_lat_na'] = df['dst_lat']
+        df['dst_long_na'] = df['dst_long']
+        for prefix in ['src_','dst_']:
+            aggregates = df[[prefix + c for c in columns]]
+            if len(columns) == 1:
+                aggregates = aggregates.iloc[:,0]
+            else:
+                aggregates = pd.MultiIndex.from_frame(aggregates)
+            located = centroids.reindex(aggregates)
+            df[prefix + 'lat'] = located['lat'].to_numpy()
+            df[prefix + 'long'] = located['long'].to_numpy()
+        keys.addLocationIds(df, self.locationPrecision)
+
+    def centroids(self, columns, weight = None, df = None):
+        """
+        Computes the centroid location of every aggregate key in a single pass over the stacked src and dst columns.
+        df: The flows to compute centroids of. Default = None (The class dataframe)
+        Returns a dataframe indexed by the key with lat and long columns.
         """
-        self.df['src_lat_na'] = self.df['src_lat']
-        self.df['src_long_na'] = self.df['src_long']
-        self.df['dst_lat_na'] = self.df['dst_lat']
-        self.df['dst_long_na'] = self.df['dst_long']
-        self.agg_locs = {}
-        columnList = self.df['src_' + column].unique().tolist()
-        columnList += self.df['dst_' + column].unique().tolist()
-        columnList = set(columnList)
-        for x in columnList:
-            lat_sum = self.df[self.df['src_' + column] == x]['src_lat'].sum()
-            lat_count = len(self.df[self.df['src_' + column] == x])
-            lat_sum += self.df[self.df['dst_' + column] == x]['dst_lat'].sum()
-            lat_count += len(self.df[self.df['dst_' + column] == x])
-            long_sum = self.df[self.df['src_' + column] == x]['src_long'].sum()
-            long_count = len(self.df[self.df['src_' + column] == x])
-            long_sum += self.df[self.df['dst_' + column] == x]['dst_long'].sum()
-            long_count += len(self.df[self.df['dst_' + column] == x])
-            self.agg_lats[x] = lat_sum/lat_count
-            self.agg_longs[x] = long_sum/long_count
-        self.df['src_lat'] = self.df['src_' + column].map(self.agg_lats)
-        self.df['src_long'] = self.df['src_' + column].map(self.agg_longs)
-        self.df['dst_lat'] = self.df['dst_' + column].map(self.agg_lats)
-        self.df['dst_long'] = self.df['dst_' + column].map(self.agg_longs)
+        if df is None:
+            df = self.df
+        stacked = []
+        for prefix in ['src_','dst_']:
+            side = df[[prefix + c for c in columns] + [prefix + 'lat', prefix + 'long']]
+            side.columns = columns + ['lat','long']
+            if weight != None:
+                side = side.assign(w = df[weight].to_numpy())
+            else:
+                side = side.assign(w = 1)
+            stacked.append(side)
+        stacked = pd.concat(stacked, ignore_index = True)
+        stacked['lat'] = stacked['lat']*stacked['w']
+        stacked['long'] = stacked['long']*stacked['w']
+        sums = stacked.groupby(columns)[['lat','long','w']].sum()
+        return pd.DataFrame({'lat':sums['lat']/sums['w'],'long':sums['long']/sums['w']})
     
     def split(self):
         """
-        Splits class dataframe into intra and inter communication flows.
+        Splits class dataframe into intra and inter communication flows by comparing location ids.
+        Flows with a missing or infinite coordinate are left out.
         """
-        self.intra = self.df.query('src_lat == dst_lat and src_long == dst_long')
-        self.inter = self.df.drop(self.intra.index.tolist())
+        self.locationIds()
+        df = self.df
+        valid = keys.located(df)
+        if not valid.all():
+            df = df[valid]
+        isIntra = (df[keys.SRC] == df[keys.DST]).to_numpy()
+        self.intra = df[isIntra]
+        self.inter = df[~isIntra]
             
-    def makePopupHTML(self, df, data = True):
+    def pruneEdges(self):
+        """
+        Selects the lines that are drawn when pruneTop, prunePerNode or pruneThreshold is set, lines have to pass every one of them.
+        Lines are ranked by the sum of pruneWeight over their flows in one grouped pass (the FlowSummary stats for maps made with fromChunks).
+        The lines, flows and pruneWeight of the lines that are not drawn are summed per location into self.pruned,
+        which marker popups show as the other traffic of the location.
+        """
+        self.keptEdges = None
+        self.pruned = None
+        if self.pruneTop == None and self.prunePerNode == None and self.pruneThreshold == None:
+            return
+        if self.summary != None:
+            stats = self.summary.stats['edge']
+            weights = stats['count'] if self.pruneWeight == None else stats[self.pruneWeight]
+            counts = stats['count']
+            ends = stats.index.to_frame(index = False).to_numpy()
+        else:
+            low, high, forward = keys.edgeIds(self.inter, self.directedLines)
+            flows = pd.DataFrame({'low':low,'high':high})
+            flows['w'] = 1 if self.pruneWeight == None else self.inter[self.pruneWeight].to_numpy()
+            grouped = flows.groupby(['low','high'])
+            weights = grouped['w'].sum()
+            counts = grouped.size()
+            ends = np.array(keys.edgeKeys(weights.index.get_level_values(0), weights.index.get_level_values(1), self.locationPrecision)).reshape(-1, 4)
+        totals = weights.to_numpy()
+        weights = totals.astype(float)
+        counts = counts.to_numpy().astype('int64')
+        keep = np.ones(len(weights), dtype = bool)
+        if self.pruneThreshold != None:
+            keep &= weights >= self.pruneThreshold
+        if self.pruneTop != None:
+            rank = np.empty(len(weights), dtype = int)
+            rank[np.argsort(-weights, kind = 'stable')] = np.arange(len(weights))
+            keep &= rank < self.pruneTop
+        if self.prunePerNode != None:
+            sides = pd.DataFrame({'lat':np.concatenate([ends[:,0], ends[:,2]]), 'long':np.concatenate([ends[:,1], ends[:,3]]),
+                                  'w':np.concatenate([weights, weights]), 'edge':np.tile(np.arange(len(weights)), 2)})
+            sides = sides.sort_values(by = 'w', ascending = False, kind = 'stable')
+            top = sides['edge'][(sides.groupby(['lat','long']).cumcount() < self.prunePerNode).to_numpy()]
+            perNode = np.zeros(len(weights), dtype = bool)
+            perNode[top.to_numpy()] = True
+            keep &= perNode
+        self.keptEdges = set(tuple(key) for key in ends[keep].tolist())
+        dropped = ~keep
+        other = pd.DataFrame({'lat':np.concatenate([ends[dropped,0], ends[dropped,2]]), 'long':np.concatenate([ends[dropped,1], ends[dropped,3]]),
+                              'other lines':1, 'other flows':np.tile(counts[dropped], 2)})
+        if self.pruneWeight != None:
+            other['other ' + self.pruneWeight] = np.tile(totals[dropped], 2)
+        self.pruned = other.groupby(['lat','long']).sum()
+
+    def otherHTML(self, location):
+        """
+        Creates the table of the lines of a location that are not drawn for its marker popup, returns ('', 0) if every line is drawn.
+        """
+        if self.pruned is None or location not in self.pruned.index:
+            return '', 0
+        return self.makePopupHTML(self.pruned.loc[[location]].reset_index(drop = True), data = False)
+
+    def prunedChanges(self, before):
+        """
+        Returns the locations whose pruned lines differ from before, the self.pruned of an earlier pruneEdges.
+        """
+        frames = [f for f in [before, self.pruned] if f is not None]
+        if len(frames) == 0:
+            return set()
+        if len(frames) == 1:
+            return set(frames[0].index)
+        index = before.index.union(self.pruned.index)
+        old = before.reindex(index)
+        new = self.pruned.reindex(index)
+        same = ((old == new) | (old.isna() & new.isna())).all(axis = 1).to_numpy()
+        return set(index[~same])
+
+    def makePopupHTML(self, df, data = True, table = None, plotDF = None):
         """
         Creates HTML code to embed in marker and line popups.
         Data is enabled if a plot needs to be made.
         Plot will only be made if user defines x and y variables.
+        table: Table html already made by popupTables, if not given the table is made from the first popupLen rows of df.
+        plotDF: Flows to plot instead of df, e.g. the plot aggregates of a streamed map.
         """
         h = ''
         ipix = 75*(min(len(df),self.popupLen))
         ipix = max(ipix,130)
         if self.plotX != None and self.plotY != None and len(df) > 1 and data:
-            h = self.makePlot(df)
+            h = self.makePlot(df if plotDF is None else plotDF)
             ipix += 400
-        if len(df) > self.popupLen:
-            df = df.iloc[0:self.popupLen]
-        if self.sortVar != None and data:
-            df = df.sort_values(by=[self.sortVar],ascending = False).reset_index(drop=True)
-        if self.popupOrder != None and data:
-            df = df[self.popupOrder]
-        html = df.to_html(escape = False).replace('<td>','<td align = "center">').replace('<thead>','<thead align = "center">').replace('border="1"','border="5"').replace('<tr style="text-align: right;">','<tr style="text-align: center;">')
+        if table != None:
+            html = table
+        else:
+            if len(df) > self.popupLen:
+                df = df.iloc[0:self.popupLen]
+            if self.sortVar != None and data:
+                df = df.sort_values(by=[self.sortVar],ascending = False).reset_index(drop=True)
+            if self.popupOrder != None and data:
+                df = df[self.popupOrder]
+            html = tables.renderTable(df.drop(columns = keys.IDS, errors = 'ignore'))
         if h != '':
             html = h + html
         return html, ipix
-            
-    def intraMarkers(self):
+
+    def summaryPlot(self, name, key):
+        """
+        Returns the plot aggregates of a location ('intra') or edge ('edge') of a map made with fromChunks, otherwise None.
+        """
+        if self.summary == None:
+            return None
+        return self.summary.plotFrame(name, key)
+
+    def topRows(self, df, groups):
+        """
+        Selects the rows shown in the popup of every group at once: the popupLen rows with the largest sortVar,
+        or the first popupLen rows if sortVar is not set.
+        groups: Dictionary of key: row positions in df, every row belongs to at most one group.
+        Returns a dictionary of key: row positions in the order they are shown.
+        """
+        label = np.full(len(df), -1)
+        for number, positions in enumerate(groups.values()):
+            label[positions] = number
+        if self.sortVar != None:
+            order = df[self.sortVar].reset_index(drop = True).sort_values(ascending = False, kind = 'stable').index.to_numpy()
+        else:
+            order = np.arange(len(df))
+        order = order[label[order] >= 0]
+        rank = pd.Series(label[order]).groupby(label[order]).cumcount().to_numpy()
+        order = order[rank < self.popupLen]
+        order = order[np.argsort(label[order], kind = 'stable')]
+        bounds = np.searchsorted(label[order], np.arange(len(groups) + 1))
+        return dict((key, order[bounds[number]:bounds[number + 1]]) for number, key in enumerate(groups))
+
+    def popupTables(self, df, groups, resetIndex):
+        """
+        Creates the popup table html of every group of rows of df in one grouped top-N step.
+        groups: Dictionary of key: row positions in df.
+        resetIndex: Number the rows of each table from 0 instead of showing the index of df.
+        Returns a dictionary of key: html.
+        """
+        top = self.topRows(df, groups)
+        if self.popupOrder != None:
+            return tables.renderTables(df[self.popupOrder], top, resetIndex)
+        return tables.renderTables(df, top, resetIndex, [c for c in df.columns if c not in keys.IDS])
+
+    def logoURL(self, logo):
+        """
+        Strips the img tag added by dfAddLogos from a logo and returns its url.
+        """
+        return logo.replace('<img src="','').replace('" height="50" width="50">','')
+
+    def resolveLogos(self, df = None):
+        """
+        Checks every logo in the class dataframe at once with the logoResolver, so markers only read cached results.
+        df: The flows to check the logos of. Default = None (The class dataframe)
+        """
+        if df is None:
+            df = self.df
+        if self.getMarkerLogos and self.logoCheck:
+            logos = pd.concat([df['src_logo'],df['dst_logo']]).dropna().unique().tolist()
+            self.logoResolver.resolve([self.logoURL(x) for x in logos if isinstance(x, str)])
+
+    def pickLogo(self, logos):
+        """
+        Returns the url of the first logo that can be reached (the first logo if logoCheck is disabled), or None.
+        logos: Pandas series of logos for a marker.
+        """
+        urls = [self.logoURL(x) for x in logos.unique().tolist() if isinstance(x, str)]
+        if not self.logoCheck:
+            return urls[0] if len(urls) > 0 else None
+        valid = self.logoResolver.resolve(urls)
+        for url in urls:
+            if valid[url]:
+                return url
+        return None
+
+    def locationIndex(self, df, prefix):
+        """
+        Maps every unique location of the prefix_ side of df, as its rounded (lat, long), to the row positions it appears at.
+        Built once with a groupby on the location ids so markers can pull their rows by position instead of rescanning df.
+        """
+        indices = df.groupby(keys.SRC if prefix == 'src_' else keys.DST).indices
+        return dict(zip(keys.locationKeys(list(indices), self.locationPrecision), indices.values()))
+
+    def intraMarkers(self, locations = None):
         """
         Creates html for intra-communication markers and stores them into dictionary to be rendered later.
+        locations: Set of (lat, long) to make the markers of again, replacing the ones made before. Default = None (Every location)
         """
-        unique = self.intra.groupby(['src_lat','src_long']).size().reset_index()
-        for index, row in unique.iterrows():
+        index = self.locationIndex(self.intra, 'src_')
+        if locations != None:
+            index = dict((location, positions) for location, positions in index.items() if location in locations)
+            self.markerList1 = [m for m in self.markerList1 if (m['lat'], m['long']) not in locations]
+        popupTables = self.popupTables(self.intra, index, True)
+        for location in sorted(index):
             html = ''
             src_html = ''
-            location = [row['src_lat'],row['src_long']]
-            temp = self.intra[(self.intra['src_lat'] == location[0]) & (self.intra['src_long'] == location[1])].reset_index(drop=True)
-            html,ipix = self.makePopupHTML(temp)
+            temp = self.intra.iloc[index[location]].reset_index(drop=True)
+            html,ipix = self.makePopupHTML(temp, table = popupTables[location], plotDF = self.summaryPlot('intra', location))
             if self.getMarkerLogos:
-                for x in temp['src_logo'].unique().tolist():
-                    try:
-                        logo = x.replace('<img src="','').replace('" height="50" width="50">','')
-                        if self.logoCheck:
-                            urllib.request.urlretrieve(logo)
-                        break
-                    except urllib.error.HTTPError:
-                        logo = None
+                logo = self.pickLogo(temp['src_logo'])
             else:
                 logo = None
-            columns = ['lat','long','count']
-            unique.columns = columns
             if self.markerInfo == None:
                 markerInfo = [s.replace('src_','') for s in self.df.columns.tolist() if 'src_' in s]
             else:
@@ -223,25 +695,24 @@ class Map():
             tempdict = {'lat':location[0],'long':location[1],'html1':html,'html2':src_html,'logo':logo,'ipix':ipix + ipix2}
             self.markerList1.append(tempdict)
                 
-    def interMarkers(self):
+    def interMarkers(self, locations = None):
         """
         Creates html for inter-communication markers and stores them into dictionary to be rendered later.
+        locations: Set of (lat, long) to make the markers of again, replacing the ones made before. Default = None (Every location)
         """
-        columns = ['lat','long','count']
-        unique = self.inter.groupby(['src_lat','src_long']).size().reset_index()
-        unique1 = self.inter.groupby(['dst_lat','dst_long']).size().reset_index()
-        unique.columns = columns
-        unique1.columns = columns
-        unique = pd.concat([unique,unique1]).reset_index(drop = True)
-        unique = unique.groupby(['lat','long']).size().reset_index()
-        for index, row in unique.iterrows():
+        src_index = self.locationIndex(self.inter, 'src_')
+        dst_index = self.locationIndex(self.inter, 'dst_')
+        made = set(src_index) | set(dst_index)
+        if locations != None:
+            made = made & locations
+            self.markerList2 = [m for m in self.markerList2 if (m['lat'], m['long']) not in locations]
+        for location in sorted(made):
             src_html = ''
             dst_html = ''
-            location = [row['lat'],row['long']]
-            temp = self.inter[((self.inter['src_lat'] == location[0]) & (self.inter['src_long'] == location[1])) | ((self.inter['dst_lat'] == location[0]) & (self.inter['dst_long'] == location[1]))].reset_index(drop=True)
-            check_src = temp[(temp['src_lat'] == location[0]) & (temp['src_long'] == location[1])]
-            check_dst = temp[(temp['dst_lat'] == location[0]) & (temp['dst_long'] == location[1])]
-            if len(check_src) > 0:
+            rows = np.union1d(src_index.get(location, []), dst_index.get(location, [])).astype(int)
+            if location in src_index:
+                check_src = self.inter.iloc[src_index[location]]
+                check_src.index = np.searchsorted(rows, src_index[location])
                 if self.markerInfo == None:
                     markerInfo = [s.replace('src_','') for s in self.df.columns.tolist() if 'src_' in s]
                 else:
@@ -252,17 +723,12 @@ class Map():
                 tempdf = tempdf.drop_duplicates()
                 src_html,ipix = self.makePopupHTML(tempdf,data=False)
                 if self.getMarkerLogos:
-                    for x in check_src['src_logo'].unique().tolist():
-                        try:
-                            logo = x.replace('<img src="','').replace('" height="50" width="50">','')
-                            if self.logoCheck:
-                                urllib.request.urlretrieve(logo)
-                            break
-                        except urllib.error.HTTPError:
-                            logo = None
+                    logo = self.pickLogo(check_src['src_logo'])
                 else:
                     logo = None
-            elif len(check_dst) > 0:
+            else:
+                check_dst = self.inter.iloc[dst_index[location]]
+                check_dst.index = np.searchsorted(rows, dst_index[location])
                 if self.markerInfo == None:
                     markerInfo = [s.replace('dst_','') for s in self.df.columns.tolist() if 'dst_' in s]
                 else:
@@ -273,110 +739,423 @@ class Map():
                 tempdf = tempdf.drop_duplicates()
                 dst_html,ipix = self.makePopupHTML(tempdf,data=False)
                 if self.getMarkerLogos:
-                    for x in check_dst['dst_logo'].unique().tolist():
-                        logo = x.replace('<img src="','').replace('" height="50" width="50">','')
-                        if self.logoCheck and logo != None:
-                            try:
-                                urllib.request.urlretrieve(logo)
-                                break
-                            except urllib.error.HTTPError:
-                                logo = None
-                        else:
-                            logo = None
+                    logo = self.pickLogo(check_dst['dst_logo'])
                 else:
                     logo = None
-            tempdict = {'lat':location[0],'long':location[1],'html1':'','html2':src_html + dst_html,'logo':logo,'ipix':ipix}
+            other_html,ipix2 = self.otherHTML(location)
+            tempdict = {'lat':location[0],'long':location[1],'html1':'','html2':src_html + dst_html + other_html,'logo':logo,'ipix':ipix + ipix2}
             self.markerList2.append(tempdict)
             
-    def addMarkers(self):
+    def addMarkers(self, locations = None):
         """
         Renders markers on class map based on html generated from inter and intra marker functions.
+        locations: Set of (lat, long) to render again, replacing the markers already on the map. Default = None (Every marker)
         """
-        df1 = pd.DataFrame(self.markerList1)
-        df2 = pd.DataFrame(self.markerList2)
-        df3 = pd.concat([df1,df2])
-        generate = df3.groupby(['lat','long']).size().reset_index()
-        for index,row in generate.iterrows():
-            temp = df3[(df3['lat'] == row['lat']) & (df3['long'] == row['long'])]
+        self.renderPlots()
+        entries = {}
+        for marker in self.markerList1 + self.markerList2:
+            entries.setdefault((marker['lat'], marker['long']), []).append(marker)
+        for location in sorted(entries):
+            if locations != None and location not in locations:
+                continue
             html = ''
             logo = None
-            ipix = min(800,sum(temp['ipix']))
-            for index,row in temp.iterrows():
-                html = html + row['html1'] + row['html2']
-                if row['logo'] != None and logo == None:
-                    logo = row['logo']
-            location = [row['lat'],row['long']]
-            iframe = folium.IFrame(html=html, width=self.popupWidth['marker'], height = ipix)
-            popup = folium.Popup(iframe, max_width=2650)
+            ipix = 0
+            for marker in entries[location]:
+                html = html + marker['html1'] + marker['html2']
+                ipix += marker['ipix']
+                if pd.notna(marker['logo']) and logo == None:
+                    logo = marker['logo']
+            ipix = min(800,ipix)
+            number = self.markerIds.setdefault(location, len(self.markerIds))
+            if self.bulkLayers:
+                self.markerFeatures[location] = self.markerFeature(location, html, ipix, logo, 'marker-%d' % number)
+                continue
+            popup = self.makePopup(html, self.popupWidth['marker'], ipix, 'marker-%d' % number)
             if logo != None:
-                icon = CustomIcon(
-                        logo,
-                        icon_size=(40, 40),
-                        popup_anchor=(0, -20))
+                icon = self.makeIcon(logo)
                 m1 = folium.Marker(
-                        location=location,
+                        location=list(location),
                         popup=popup,
                         icon = icon)
             else:
                 m1 = folium.Marker(
-                        location=location,
+                        location=list(location),
                         popup=popup
                         )
-            self.m.add_child(m1)
-            
+            self.replaceChild(self.markerElements, location, m1)
+        if self.bulkLayers:
+            self.m.add_child(layers.FeatureLayer(list(self.markerFeatures.values()), self.bulkCluster), name = 'ra_markers')
+        self.embedAssets()
+
+    def markerFeature(self, location, html, ipix, logo, name):
+        """
+        Creates the GeoJSON feature of a marker for the bulk marker layer.
+        """
+        popup = self.popupContent(html, self.popupWidth['marker'], ipix, name)
+        if logo != None and self.shareAssets and logo.startswith('data:'):
+            return layers.marker(location, popup, iconHtml = self.assets.icon(logo, (40, 40)))
+        return layers.marker(location, popup, icon = logo)
+
+    def replaceChild(self, elements, key, element):
+        """
+        Adds a marker or line to the class map in place of the one added before for the same key.
+        elements: Dictionary of key: element already on the map.
+        """
+        if key in elements:
+            del self.m._children[elements[key].get_name()]
+        elements[key] = element
+        self.m.add_child(element)
+
+    def makePopup(self, html, width, height, name):
+        """
+        Creates a popup for a marker or line.
+        With lazyPopups the html is kept to be written to its own file by saveMap and the popup only loads it when opened.
+        With shareAssets the popup is added to the page so it can use the shared assets, otherwise it is put in an iframe.
+        Popups added to the page are written by folium in a javascript template literal, so backslashes, backticks, ${ and </ (which would close the script) are escaped.
+        name: Id of the marker or line, used to name the popup file.
+        """
+        if self.lazyPopups or self.shareAssets:
+            content = self.popupContent(html, width, height, name).replace('\\', '\\\\').replace('`', '\\`').replace('${', '\\${').replace('</', '<\\/')
+            element = folium.Html(content, script = True, width = width, height = height)
+            return folium.Popup(element, max_width=2650)
+        iframe = folium.IFrame(html=html, width=width, height = height)
+        return folium.Popup(iframe, max_width=2650)
+
+    def popupContent(self, html, width, height, name):
+        """
+        Returns the html put in the popup of a marker or line (see makePopup).
+        """
+        if self.lazyPopups:
+            if self.shareAssets:
+                html = self.assets.rewrite(html)
+            self.popupFiles[name] = html
+            return popups.placeholder(name, width, height)
+        if self.shareAssets:
+            return '<div class="ra-popup">' + self.assets.rewrite(html) + '</div>'
+        return folium.IFrame(html=html, width=width, height = height).render()
+
+    def makeIcon(self, logo):
+        """
+        Creates a marker icon from a logo url, data: urls are shared assets if shareAssets is enabled.
+        """
+        if self.shareAssets and logo.startswith('data:'):
+            return folium.DivIcon(
+                    html=self.assets.icon(logo, (40, 40)),
+                    icon_size=(40, 40),
+                    icon_anchor=(20, 20),
+                    popup_anchor=(0, -20))
+        return CustomIcon(
+                logo,
+                icon_size=(40, 40),
+                popup_anchor=(0, -20))
+
+    def embedAssets(self):
+        """
+        Adds the stylesheet with the shared assets to the class map, replacing the one added before.
+        """
+        if self.shareAssets and len(self.assets) > 0:
+            self.m.get_root().header.add_child(folium.Element(self.assets.css()), name = 'ra_assets')
+
+    def edgeIndex(self):
+        """
+        Maps every line that will be drawn to the row positions of its flows in the inter dataframe.
+        Flows are grouped in one pass on a canonical undirected key (ordered pair of location ids) so both directions share a line,
+        unless directedLines is set. Returns a sorted list of (location1, location2, positions).
+        """
+        low, high, forward = keys.edgeIds(self.inter, self.directedLines)
+        if len(low) == 0:
+            return []
+        codes = pd.DataFrame({'low':low,'high':high}).groupby(['low','high']).ngroup().to_numpy()
+        order = np.argsort(codes, kind = 'stable')
+        bounds = np.searchsorted(codes[order], np.arange(codes.max() + 2))
+        first = order[bounds[:-1]]
+        isForward = np.logical_or.reduceat(forward[order], bounds[:-1])
+        lat1, long1 = keys.locations(np.where(isForward, low[first], high[first]), self.locationPrecision)
+        lat2, long2 = keys.locations(np.where(isForward, high[first], low[first]), self.locationPrecision)
+        lat1, long1, lat2, long2 = lat1.tolist(), long1.tolist(), lat2.tolist(), long2.tolist()
+        starts = bounds.tolist()
+        edges = []
+        for number in np.lexsort((long2, lat2, long1, lat1)).tolist():
+            edges.append(([lat1[number],long1[number]], [lat2[number],long2[number]], order[starts[number]:starts[number + 1]]))
+        return edges
+
+    def edgeKey(self, location1, location2):
+        """
+        Returns the key of the line between two locations, the ordered endpoint pair unless directedLines is set.
+        """
+        if self.directedLines:
+            return tuple(location1 + location2)
+        return tuple(min(location1, location2) + max(location1, location2))
+
+    def makeLines(self, edges = None):
+        """
+        Creates html for line popups and stores them into a list to be rendered later.
+        edges: Set of line keys (see edgeKey) to make again, replacing the ones made before. Default = None (Every line)
+        """
+        made = self.edgeIndex()
+        if self.keptEdges != None:
+            made = [edge for edge in made if self.edgeKey(edge[0], edge[1]) in self.keptEdges]
+        if edges != None:
+            if self.keptEdges != None:
+                edges = set(edges) | (self.keptEdges - set(line['key'] for line in self.lineList))
+            made = [edge for edge in made if self.edgeKey(edge[0], edge[1]) in edges]
+            self.lineList = [line for line in self.lineList if line['key'] not in edges and (self.keptEdges == None or line['key'] in self.keptEdges)]
+        else:
+            self.lineList = []
+        popupTables = self.popupTables(self.inter, dict(enumerate(edge[2] for edge in made)), self.sortVar != None)
+        if self.lineStyle != None and len(made) > 0:
+            styles = self.styleLines(made)
+        for number, (location1, location2, positions) in enumerate(made):
+            temp = self.inter.iloc[positions]
+            if self.lineStyle != None:
+                color, opacity, weight = styles['color'][number], styles['opacity'][number], styles['weight'][number]
+            else:
+                color, opacity, weight = self.lineFunction(temp), self.lineOpacity, None
+            key = self.edgeKey(location1, location2)
+            html,ipix = self.makePopupHTML(temp, table = popupTables[number], plotDF = self.summaryPlot('edge', key))
+            ipix = min(800,ipix)
+            self.lineList.append({'location1':location1,'location2':location2,'key':key,'html':html,'ipix':ipix,
+                                  'color':color,'opacity':opacity,'weight':weight})
+
+    def addLines(self, edges = None):
+        """
+        Renders lines on class map based on html generated from makeLines.
+        edges: Set of line keys to render again, replacing the lines already on the map. Default = None (Every line)
+        Lines that are not on the map yet are always rendered and lines no longer in the line list (e.g. pruned after an update) are removed.
+        """
+        listed = set(line['key'] for line in self.lineList)
+        for key in [k for k in self.lineElements if k not in listed]:
+            del self.m._children[self.lineElements.pop(key).get_name()]
+        for key in [k for k in self.lineFeatures if k not in listed]:
+            del self.lineFeatures[key]
+        for line in self.lineList:
+            drawn = line['key'] in self.lineElements or line['key'] in self.lineFeatures
+            if edges != None and line['key'] not in edges and drawn:
+                continue
+            self.lineColor = line['color']
+            number = self.lineIds.setdefault(line['key'], len(self.lineIds))
+            if self.bulkLayers:
+                style = {'color':line['color'],'opacity':line['opacity']}
+                if line['weight'] != None:
+                    style['weight'] = line['weight']
+                popup = self.popupContent(line['html'], self.popupWidth['line'], line['ipix'], 'line-%d' % number)
+                self.lineFeatures[line['key']] = layers.line(line['location1'], line['location2'], popup, style)
+                continue
+            popup = self.makePopup(line['html'], self.popupWidth['line'], line['ipix'], 'line-%d' % number)
+            options = {} if line['weight'] == None else {'weight':line['weight']}
+            myline = folium.PolyLine([line['location1'],line['location2']], color = self.lineColor,opacity = line['opacity'], popup = popup, **options)
+            self.replaceChild(self.lineElements, line['key'], myline)
+        if self.bulkLayers:
+            self.m.add_child(layers.FeatureLayer(list(self.lineFeatures.values())), name = 'ra_lines')
+        self.embedAssets()
+
     def drawLines(self):
         """
         Creates html for line popups, then renders lines on class map.
         """
-        sortDF = self.inter.groupby(['src_lat','src_long','dst_lat','dst_long']).size().reset_index()
-        
-        droplist = []
-        for index,row in sortDF.iterrows():
-            test = sortDF.loc[(sortDF['src_lat'] == row['dst_lat']) & 
-                            (sortDF['src_long'] == row['dst_long']) &
-                            (sortDF['dst_lat'] == row['src_lat']) &
-                            (sortDF['dst_long'] == row['src_long'])].index
-            if len(test) > 0:
-                if index not in droplist:
-                    droplist.append(test[0])
-        sortDF.drop(droplist,inplace = True)
-        
-        for index,row in sortDF.iterrows():
-            location1 = [row['src_lat'],row['src_long']]
-            location2 = [row['dst_lat'],row['dst_long']]
-            temp = self.inter[((self.inter['src_lat'] == row['src_lat']) & 
-                              (self.inter['src_long'] == row['src_long']) &
-                              (self.inter['dst_lat'] == row['dst_lat']) &
-                              (self.inter['dst_long'] == row['dst_long'])) |
-                              ((self.inter['src_lat'] == row['dst_lat']) & 
-                              (self.inter['src_long'] == row['dst_long']) &
-                              (self.inter['dst_lat'] == row['src_lat']) &
-                              (self.inter['dst_long'] == row['src_long']))]
-            self.lineColor = self.lineFunction(temp)
-            html,ipix = self.makePopupHTML(temp)
-            ipix = min(800,ipix)
-            iframe = folium.IFrame(html=html, width=self.popupWidth['line'], height = ipix)
-            popup = folium.Popup(iframe, max_width=2650)
-            myline = folium.PolyLine([location1,location2], color = self.lineColor,opacity = self.lineOpacity, popup = popup)
-            self.m.add_child(myline)
+        self.pruneEdges()
+        self.makeLines()
+        self.renderPlots()
+        self.addLines()
         
     def saveMap(self, savefile):
         """
         Saves map file.
         Can be saved as a .ejs file to be rendered on a server.
+        With lazyPopups the popups are written to a savefile_popups directory next to the map, which has to be served with it.
         """
         if '.html' not in savefile and '.ejs' not in savefile:
             savefile = savefile + '.html'   
-        self.m.save(savefile)
-    
+        with self.stage('saveMap'):
+            if self.lazyPopups:
+                directory = os.path.splitext(savefile)[0] + '_popups'
+                stylesheet = self.assets.stylesheet() if self.shareAssets else None
+                popups.writePopups(directory, self.popupFiles, stylesheet)
+                self.m.add_child(popups.LazyPopups(os.path.basename(directory) + '/'), name = 'ra_lazy')
+            self.m.save(savefile)
+        if self.stats is not None:
+            self.stats.counters['htmlBytes'] = os.path.getsize(savefile)
+
+    def stage(self, name):
+        """
+        Returns the with block context that times a stage of building the map if profiling, otherwise one that does nothing.
+        """
+        if self.stats is None:
+            return nullcontext()
+        return self.stats.stage(name)
+
+    def countStats(self, logoRequests, plotCacheHits):
+        """
+        Adds the counters of the map made by createMap to stats.
+        logoRequests, plotCacheHits: The logoResolver requests and plotCache hits before createMap started.
+        """
+        self.stats.count('flows', len(self.intra) + len(self.inter))
+        self.stats.count('intraFlows', len(self.intra))
+        self.stats.count('markers', len(self.markerElements) + len(self.markerFeatures))
+        self.stats.count('lines', len(self.lineList))
+        if self.pruned is not None:
+            self.stats.count('prunedLines', int(self.pruned['other lines'].sum()//2))
+        self.stats.count('logoRequests', self.logoResolver.requests - logoRequests)
+        if self.plotCache != None:
+            self.stats.count('plotCacheHits', self.plotCache.hits + self.plotCache.diskHits - plotCacheHits)
+        popupBytes = sum(len(m['html1']) + len(m['html2']) for m in self.markerList1 + self.markerList2)
+        self.stats.count('popupBytes', popupBytes + sum(len(line['html']) for line in self.lineList))
+
     def createMap(self):
         """
         Calls appropriate functions to create a map from Ra instance dataframe.
+        If profile or profileCallbacks is set every stage is timed and the MapStats is returned, otherwise None is returned.
+        Starts from a clean render state (see reset), so calling it again (e.g. after focus) makes a new map instead of adding to the last one.
+        """
+        self.reset()
+        self.stats = MapStats(self.profileCallbacks) if self.profile or self.profileCallbacks else None
+        logoRequests = self.logoResolver.requests
+        plotCacheHits = self.plotCache.hits + self.plotCache.diskHits if self.plotCache != None else 0
+        with self.stage('setup'):
+            pd.set_option('display.max_colwidth', None)
+            plot.setStyle()
+        for name in ['split','pruneEdges','resolveLogos','intraMarkers','interMarkers','makeLines','renderPlots','addMarkers','addLines']:
+            with self.stage(name):
+                getattr(self, name)()
+        if self.stats is not None:
+            self.countStats(logoRequests, plotCacheHits)
+        return self.stats
+
+    def update(self, new_df):
         """
-        pd.set_option('display.max_colwidth', -1)
-        sns.set(font_scale = 1.25)
+        Adds new flows to the class dataframe and, if createMap was called, rebuilds only the markers, lines and popups
+        of the locations and edges the new flows touch. Every other marker and line keeps the html and plots made before.
+        New flows are moved onto the aggregates made by aggregate (new aggregate keys get the centroid of their new flows),
+        numbered after the last row if the class dataframe has an integer index, and filtered by the focus filters applied.
+        new_df: Pandas dataframe of new flows with the columns of the class dataframe.
+        """
+        if 'src_lat' not in list(new_df) or 'src_long' not in list(new_df) or  'dst_lat' not in list(new_df) or 'dst_long' not in list(new_df):
+            raise ValueError('Dataset does not contain correct columns')
+        filters = [op for op, mask in self.filters]
+        if self.summary != None:
+            self.summary.add(new_df)
+            self.df = self.summary.flows()
+            added = new_df.copy()
+            keys.addLocationIds(added, self.locationPrecision)
+        else:
+            added = new_df.copy()
+            if self.aggregated != None:
+                columns, weight = self.aggregated
+                if self.spatialCells != None:
+                    self.addCells(added)
+                known = pd.DataFrame({'lat':pd.Series(self.agg_lats, dtype = float),'long':pd.Series(self.agg_longs, dtype = float)})
+                centroids = self.centroids(columns, weight, added)
+                centroids = pd.concat([known, centroids[~centroids.index.isin(known.index)]])
+                self.moveToCentroids(added, columns, centroids)
+                self.agg_lats.update(centroids['lat'].to_dict())
+                self.agg_longs.update(centroids['long'].to_dict())
+            keys.addLocationIds(added, self.locationPrecision)
+            if self.origdf.index.dtype.kind in 'iu' and len(self.origdf) > 0:
+                added.index = pd.RangeIndex(self.origdf.index.max() + 1, self.origdf.index.max() + 1 + len(added))
+            self.df = pd.concat([self.origdf, added])
+        for op in filters:
+            self.focus(op)
+            added = added[np.asarray(added.eval(op), dtype = bool)]
+        if self.intra is None:
+            return
+        added = added[keys.located(added)]
+        isIntra = (added[keys.SRC] == added[keys.DST]).to_numpy()
+        intra = added[isIntra]
+        inter = added[~isIntra]
+        intraLocations = set(keys.locationKeys(intra[keys.SRC], self.locationPrecision))
+        interLocations = set(keys.locationKeys(inter[keys.SRC], self.locationPrecision)) | set(keys.locationKeys(inter[keys.DST], self.locationPrecision))
+        low, high, forward = keys.edgeIds(inter, self.directedLines)
+        edges = set(keys.edgeKeys(low, high, self.locationPrecision))
         self.split()
-        self.intraMarkers()
-        self.interMarkers()
-        self.addMarkers()
-        self.drawLines()
\ No newline at end of file
+        pruned = self.pruned
+        self.pruneEdges()
+        interLocations |= self.prunedChanges(pruned)
+        self.resolveLogos(added)
+        self.intraMarkers(intraLocations)
+        self.interMarkers(interLocations)
+        self.makeLines(edges)
+        self.renderPlots()
+        self.addMarkers(intraLocations | interLocations)
+        self.addLines(edges)
+
+    def batchState(self):
+        """
+        Returns the (class, state, methods) every map of a batch is made from: the settings and preprocessed state
+        (location ids precision, aggregate centroids, checked logos) of this map without its dataframe and render state,
+        and the functions set with setLineFunction or setLineStyle, which are bound to every map again.
+        """
+        blank = object.__new__(type(self))
+        blank.reset()
+        skip = set(blank.__dict__) | set(['origdf','filters','view'])
+        state = {}
+        methods = {}
+        for name, value in self.__dict__.items():
+            if name in skip:
+                continue
+            if isinstance(value, MethodType) and value.__self__ is self:
+                methods[name] = value.__func__
+            else:
+                state[name] = value
+        state['logoResolver'] = self.logoResolver
+        return type(self), state, methods
+
+    def renderBatch(self, savefile, by = None, queries = None, workers = None, progress = None):
+        """
+        Creates and saves one map per partition of the class dataframe, in a pool of worker processes if workers is given.
+        Every map gets the settings, location ids, aggregate centroids and checked logos of this map, so set the settings
+        and call aggregate before rendering the batch instead of once per map.
+        savefile: Path of the maps with {key} where the partition key goes, e.g. 'maps/{key}.html'.
+        by: Column name (or list of column names) to make one map per value of.
+        queries: List of df.query strings (as used by focus), or dictionary of key: df.query string, to make one map per query.
+        The key of a query in a list is its position.
+        workers: Number of worker processes to create maps with, popup plots are then rendered in the worker. Default = None (One after the other)
+        progress: Function called as progress(done, total, key, result) when a map is done. Default = None
+        Returns a dictionary of key: {'savefile', 'rows', 'seconds', 'error'} in partition order,
+        error is the traceback (or the query error) of a map that failed and None for maps that were saved.
+        """
+        if (by is None) == (queries is None):
+            raise ValueError('Give either a partition column (by) or queries')
+        if '{key}' not in savefile:
+            raise ValueError('savefile has to contain {key}')
+        if self.summary != None:
+            raise ValueError('Maps built from chunks can not be rendered in batches')
+        self.locationIds()
+        self.resolveLogos()
+        df = self.df
+        results = {}
+        parts = []
+        if by is not None:
+            parts = list(df.groupby(by).indices.items())
+        else:
+            if not isinstance(queries, dict):
+                queries = dict(enumerate(queries))
+            for key, query in queries.items():
+                try:
+                    positions = np.flatnonzero(np.asarray(df.eval(query), dtype = bool))
+                except Exception as e:
+                    results[key] = {'savefile':None, 'rows':0, 'seconds':None, 'error':'%s: %s' % (type(e).__name__, e)}
+                    continue
+                if len(positions) == 0:
+                    results[key] = {'savefile':None, 'rows':0, 'seconds':None, 'error':'There are no flows found using this filter'}
+                    continue
+                parts.append((key, positions))
+        savefiles = {}
+        for key, positions in parts:
+            name = '_'.join(str(k) for k in key) if isinstance(key, tuple) else str(key)
+            path = savefile.format(key = re.sub(r'[^\w\-.]+', '_', name))
+            if '.html' not in path and '.ejs' not in path:
+                path = path + '.html'
+            if path in savefiles.values():
+                raise ValueError('More than one partition would be saved as %s' % path)
+            savefiles[key] = path
+        for directory in set(os.path.dirname(path) for path in savefiles.values()):
+            if directory != '':
+                os.makedirs(directory, exist_ok = True)
+        cls, state, methods = self.batchState()
+        if workers != None and workers > 1:
+            state['workers'] = None
+        jobs = ((key, df.iloc[positions], savefiles[key]) for key, positions in parts)
+        results.update(batch.renderMaps(jobs, len(parts), (cls, state, methods), workers, progress))
+        order = [key for key, positions in parts] if by is not None else list(queries)
+        return dict((key, results[key]) for key in order)
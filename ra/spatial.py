@@ -0,0 +1,125 @@
+"""
+Spatial cells for Ra maps.
+Snaps lat/long coordinates to grid, geohash or hexagonal cells with numpy, so flows between raw coordinates
+(e.g. GPS or GeoIP locations) can be aggregated like flows that share a named attribute.
+Every cell is an int64 id, cells of a mode and resolution never share an id.
+"""
+
+import numpy as np
+
+MODES = ['grid', 'geohash', 'hex']
+BASE32 = np.array(list('0123456789bcdefghjkmnpqrstuvwxyz'))
+
+def gridCells(lat, long, size):
+    """
+    Returns the id of the size x size degree square every coordinate is in.
+    """
+    lat = np.asarray(lat, dtype = float)
+    long = np.asarray(long, dtype = float)
+    columns = int(np.ceil(360.0/size)) + 1
+    row = np.floor((lat + 90.0)/size).astype('int64')
+    column = np.floor((long + 180.0)/size).astype('int64')
+    return row*columns + column
+
+def geohashCells(lat, long, precision):
+    """
+    Returns the geohash of every coordinate with precision characters (1 to 12) as an integer of 5*precision bits.
+    Dropping the last 5 bits of a geohash gives the geohash one character shorter, like dropping the last character.
+    """
+    if precision < 1 or precision > 12:
+        raise ValueError('Geohash precision has to be between 1 and 12')
+    bits = 5*precision
+    longBits = (bits + 1)//2
+    latBits = bits//2
+    lat = np.asarray(lat, dtype = float)
+    long = np.asarray(long, dtype = float)
+    latIndex = np.clip(np.floor((lat + 90.0)/180.0*2.0**latBits), 0, 2**latBits - 1).astype('int64')
+    longIndex = np.clip(np.floor((long + 180.0)/360.0*2.0**longBits), 0, 2**longBits - 1).astype('int64')
+    cells = np.zeros(len(lat), dtype = 'int64')
+    for i in range(bits):
+        if i % 2 == 0:
+            bit = (longIndex >> (longBits - 1 - i//2)) & 1
+        else:
+            bit = (latIndex >> (latBits - 1 - i//2)) & 1
+        cells = (cells << 1) | bit
+    return cells
+
+def geohashStrings(cells, precision):
+    """
+    Returns the geohash strings of cells made by geohashCells with the same precision.
+    """
+    cells = np.asarray(cells, dtype = 'int64')
+    chars = [BASE32[(cells >> (5*(precision - 1 - i))) & 31] for i in range(precision)]
+    return np.array([''.join(c) for c in zip(*chars)], dtype = object)
+
+def hexCells(lat, long, size):
+    """
+    Returns the id of the pointy top hexagon (size degrees from center to corner, on the lat/long plane) every coordinate is in.
+    """
+    x = np.asarray(long, dtype = float)
+    y = np.asarray(lat, dtype = float)
+    q = (np.sqrt(3)/3*x - y/3)/size
+    r = (2.0/3*y)/size
+    s = -q - r
+    rq = np.round(q)
+    rr = np.round(r)
+    rs = np.round(s)
+    dq = np.abs(rq - q)
+    dr = np.abs(rr - r)
+    ds = np.abs(rs - s)
+    fixQ = (dq > dr) & (dq > ds)
+    fixR = ~fixQ & (dr > ds)
+    rq = np.where(fixQ, -rr - rs, rq)
+    rr = np.where(fixR, -rq - rs, rr)
+    return (rq.astype('int64') << 32) + (rr.astype('int64') + 2**31)
+
+def cells(lat, long, mode, resolution):
+    """
+    Returns the cell id of every coordinate.
+    mode: 'grid', 'geohash' or 'hex'.
+    resolution: Cell size in degrees for grid and hex, number of characters for geohash.
+    """
+    if mode == 'grid':
+        return gridCells(lat, long, resolution)
+    if mode == 'geohash':
+        return geohashCells(lat, long, int(resolution))
+    if mode == 'hex':
+        return hexCells(lat, long, resolution)
+    raise ValueError('Spatial mode has to be one of %s' % ', '.join(MODES))
+
+def resolution(mode, zoom):
+    """
+    Returns the resolution that gives cells about 64 pixels wide on a map at a zoom level.
+    """
+    if mode == 'geohash':
+        return int(np.clip(np.ceil(2*(zoom + 2)/5.0), 1, 12))
+    if mode in MODES:
+        return 90.0/2**zoom
+    raise ValueError('Spatial mode has to be one of %s' % ', '.join(MODES))
+
+def pyramid(lat, long, mode, zooms):
+    """
+    Returns a dictionary of zoom level: cell ids, using the resolution of every zoom level.
+    Grid and geohash cells are computed once at the finest level, coarser levels are derived from them with bit shifts.
+    """
+    zooms = sorted(zooms)
+    finest = zooms[-1]
+    levels = {}
+    if mode == 'grid':
+        scale = 2.0**finest/90.0
+        lat = np.asarray(lat, dtype = float)
+        long = np.asarray(long, dtype = float)
+        row = np.floor((lat + 90.0)*scale).astype('int64')
+        column = np.floor((long + 180.0)*scale).astype('int64')
+        for zoom in zooms:
+            columns = int(np.ceil(360.0/resolution(mode, zoom))) + 1
+            levels[zoom] = (row >> (finest - zoom))*columns + (column >> (finest - zoom))
+    elif mode == 'geohash':
+        precision = resolution(mode, finest)
+        fine = geohashCells(lat, long, precision)
+        for zoom in zooms:
+            levels[zoom] = fine >> (5*(precision - resolution(mode, zoom)))
+    else:
+        for zoom in zooms:
+            levels[zoom] = cells(lat, long, mode, resolution(mode, zoom))
+    return levels
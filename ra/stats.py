@@ -0,0 +1,79 @@
+"""
+Build statistics for Ra maps.
+MapStats times every stage of building and saving a map (wall and cpu time) and keeps counters of what was made,
+so a slow map can be traced to the stage it spends its time in.
+"""
+
+import time
+from contextlib import contextmanager
+
+class MapStats():
+    """
+    MapStats collects the stage timings and counters of building a map.
+    callbacks: Functions called as callback(name, wall, cpu) when a stage ends. Default = None
+
+    Statistics:
+        stages: Dictionary of stage name: {'wall', 'cpu', 'calls', 'nested'} in the order the stages first ran,
+            nested stages (e.g. makePlot) ran inside another stage and their time is also part of that stage.
+        counters: Dictionary of counter name: value (e.g. markers, lines, plots, logoRequests, popupBytes).
+    """
+    def __init__(self, callbacks = None):
+        self.callbacks = list(callbacks or [])
+        self.stages = {}
+        self.counters = {}
+        self.depth = 0
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Times the code run in a with block as stage name, stages run more than once add up.
+        """
+        nested = self.depth > 0
+        self.depth += 1
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield self
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            self.depth -= 1
+            stage = self.stages.setdefault(name, {'wall':0.0, 'cpu':0.0, 'calls':0, 'nested':nested})
+            stage['wall'] += wall
+            stage['cpu'] += cpu
+            stage['calls'] += 1
+            for callback in self.callbacks:
+                callback(name, wall, cpu)
+
+    def count(self, name, amount = 1):
+        """
+        Adds amount to a counter.
+        """
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def wall(self):
+        """
+        Returns the wall time of every stage together, nested stages are already part of the stage they ran in.
+        """
+        return sum(stage['wall'] for stage in self.stages.values() if not stage['nested'])
+
+    def asDict(self):
+        """
+        Returns the statistics as a dictionary that can be written as json.
+        """
+        return {'stages':dict((name, dict(stage)) for name, stage in self.stages.items()), 'counters':dict(self.counters), 'wall':self.wall()}
+
+    def report(self):
+        """
+        Returns the statistics as a text table.
+        """
+        lines = ['%-14s %10s %10s %6s' % ('stage', 'wall s', 'cpu s', 'calls')]
+        for name, stage in self.stages.items():
+            lines.append('%-14s %10.3f %10.3f %6d' % (('  ' if stage['nested'] else '') + name, stage['wall'], stage['cpu'], stage['calls']))
+        lines.append('%-14s %10.3f' % ('total', self.wall()))
+        for name, value in self.counters.items():
+            lines.append('%-14s %10d' % (name, value))
+        return '\n'.join(lines)
+
+    def __repr__(self):
+        return self.report()
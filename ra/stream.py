@@ -0,0 +1,183 @@
+"""
+Streaming ingestion of flow datasets that do not fit in memory.
+FlowSummary reads flows chunk by chunk and only keeps, per location and per edge, what a map needs:
+flow counts, column sums, the rows shown in popups and the aggregates the popup plots are drawn from.
+"""
+
+import numpy as np
+import pandas as pd
+from . import keys
+
+LOCATION = ['ra_lat','ra_long']
+EDGE = ['ra_lat1','ra_long1','ra_lat2','ra_long2']
+ESTIMATORS = {sum:'sum', np.sum:'sum', 'sum':'sum', min:'min', np.min:'min', 'min':'min',
+              max:'max', np.max:'max', 'max':'max', np.mean:'mean', 'mean':'mean'}
+
+def readChunks(source, chunksize, readOptions = None):
+    """
+    Yields dataframes of at most chunksize rows from a csv or parquet file path, or from an iterable of dataframes.
+    readOptions: Dictionary of keyword arguments for pd.read_csv.
+    """
+    readOptions = readOptions or {}
+    if isinstance(source, str) and source.endswith('.parquet'):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError('Reading parquet files in chunks requires pyarrow')
+        for batch in pq.ParquetFile(source).iter_batches(batch_size = chunksize):
+            yield batch.to_pandas()
+    elif isinstance(source, str):
+        for chunk in pd.read_csv(source, chunksize = chunksize, **readOptions):
+            yield chunk
+    else:
+        for chunk in source:
+            yield chunk
+
+class FlowSummary():
+    """
+    FlowSummary incrementally summarizes flows per location (intra-communication) and per edge (inter-communication).
+    The popup settings of the map have to be known up front because they decide which rows are kept.
+
+    FlowSummary Parameters:
+        popupLen: The amount of flows that will appear in a popup. Default = 3
+        sortVar: The name of the column to sort flows by. Default = None
+        markerInfo: The column names that will appear in the marker popups. Default = None (Shows All)
+        plotX, plotY, plotHue: Plot variables, plot aggregates are only kept if plotX and plotY are set. Default = None
+        plotType: The type of plot, scatter plots keep one point per plotX and plotHue. Default = 'bar'
+        plotEstimator: sum, min, max or mean. Default = sum
+        directedLines: Keep separate edges for each direction between two locations. Default = False
+        locationPrecision: The decimals lat and long are rounded to for matching locations (see keys.locationIds). Default = 6
+
+    Summaries:
+        rows: The amount of flows read.
+        stats: Dictionary with a dataframe of flow counts and column sums for 'intra' (per location) and 'edge'.
+    """
+    def __init__(self, popupLen = 3, sortVar = None, markerInfo = None, plotX = None, plotY = None, plotHue = None,
+                 plotType = 'bar', plotEstimator = sum, directedLines = False, locationPrecision = 6):
+        if plotX != None and plotY != None and plotEstimator not in ESTIMATORS:
+            raise ValueError('Plots of streamed flows can only use a sum, min, max or mean estimator')
+        self.popupLen = popupLen
+        self.sortVar = sortVar
+        self.markerInfo = markerInfo
+        self.plotX = plotX
+        self.plotY = plotY
+        self.plotHue = plotHue
+        self.plotType = plotType
+        self.plotEstimator = plotEstimator
+        self.directedLines = directedLines
+        self.locationPrecision = locationPrecision
+        self.rows = 0
+        self.top = {}
+        self.stats = {}
+        self.plots = {}
+
+    def add(self, chunk):
+        """
+        Adds a chunk of flows to the summaries.
+        """
+        chunk = chunk.reset_index(drop = True)
+        chunk.index = pd.RangeIndex(self.rows, self.rows + len(chunk))
+        self.rows += len(chunk)
+        keys.addLocationIds(chunk, self.locationPrecision)
+        chunk = chunk[keys.located(chunk)]
+        isIntra = (chunk[keys.SRC] == chunk[keys.DST]).to_numpy()
+        intra = chunk[isIntra]
+        inter = chunk[~isIntra]
+        lat, long = keys.locations(intra[keys.SRC], self.locationPrecision)
+        intra = intra.assign(ra_lat = lat, ra_long = long)
+        low, high, forward = keys.edgeIds(inter, self.directedLines)
+        lat1, long1 = keys.locations(low, self.locationPrecision)
+        lat2, long2 = keys.locations(high, self.locationPrecision)
+        inter = inter.assign(ra_lat1 = lat1, ra_long1 = long1, ra_lat2 = lat2, ra_long2 = long2)
+        self.keepTop('intra', intra, LOCATION, self.sortVar)
+        self.keepTop('edge', inter, EDGE, self.sortVar)
+        self.keepTop('edge_forward', inter[forward], EDGE, None, count = 1)
+        for name, flows in [('intra', intra), ('inter', inter)]:
+            for prefix, ids in [('src_', keys.SRC), ('dst_', keys.DST)]:
+                lat, long = keys.locations(flows[ids], self.locationPrecision)
+                side = flows.assign(ra_lat = lat, ra_long = long)
+                self.keepTop(name + '_' + prefix, side, LOCATION, None, self.infoColumns(chunk, prefix))
+        self.addStats('intra', intra, LOCATION)
+        self.addStats('edge', inter, EDGE)
+        if self.plotX != None and self.plotY != None:
+            self.addPlot('intra', intra, LOCATION)
+            self.addPlot('edge', inter, EDGE)
+
+    def infoColumns(self, df, prefix):
+        """
+        Returns the columns shown in marker popups for one side of the flows.
+        """
+        if self.markerInfo == None:
+            return [c for c in df.columns if prefix in c]
+        return [prefix + c for c in self.markerInfo]
+
+    def keepTop(self, name, df, key, sortVar, distinct = None, count = None):
+        """
+        Merges the rows of a chunk into the rows kept for popups: the popupLen rows with the largest sortVar per key,
+        or the first popupLen rows (the first popupLen distinct rows on the distinct columns) per key.
+        count: The amount of rows to keep per key instead of popupLen.
+        """
+        if name in self.top:
+            df = pd.concat([self.top[name], df])
+        if distinct != None:
+            df = df.drop_duplicates(subset = key + distinct)
+        if sortVar != None:
+            df = df.sort_values(by = sortVar, ascending = False, kind = 'stable')
+        self.top[name] = df.groupby(key, sort = False).head(count or self.popupLen)
+
+    def addStats(self, name, df, key):
+        """
+        Adds the flow counts and numeric column sums of a chunk to the summaries.
+        """
+        numeric = [c for c in df.select_dtypes('number').columns if c not in key + keys.IDS and not c.endswith('_lat') and not c.endswith('_long')]
+        grouped = df.groupby(key)
+        stats = grouped[numeric].sum()
+        stats.insert(0, 'count', grouped.size())
+        if name in self.stats:
+            stats = self.stats[name].add(stats, fill_value = 0)
+        self.stats[name] = stats
+
+    def addPlot(self, name, df, key):
+        """
+        Adds the plot aggregates of a chunk (sum, count, min and max of plotY per plotX) to the summaries.
+        The first row of every plotX is kept too, so plots show the plotX values in the order they appear in the flows.
+        """
+        buckets = key + [self.plotX]
+        if self.plotType == 'scatter' and self.plotHue != None:
+            buckets.append(self.plotHue)
+        plots = df.groupby(buckets)[self.plotY].agg(['sum','count','min','max'])
+        plots['first'] = df.index.to_series().groupby([df[b] for b in buckets]).min()
+        if name in self.plots:
+            plots = pd.concat([self.plots[name], plots])
+            plots = plots.groupby(level = list(range(len(buckets)))).agg({'sum':'sum','count':'sum','min':'min','max':'max','first':'min'})
+        self.plots[name] = plots
+
+    def plotFrame(self, name, key):
+        """
+        Returns the flows to plot for a location ('intra') or edge ('edge') key: one row per plotX (and plotHue for scatter plots)
+        holding the estimator of plotY, so the plot drawn from it matches the plot of every flow.
+        Returns None if no plot aggregates are kept.
+        """
+        if name not in self.plots:
+            return None
+        try:
+            plots = self.plots[name].loc[tuple(key)]
+        except KeyError:
+            return None
+        plots = plots.sort_values(by = 'first')
+        estimator = ESTIMATORS[self.plotEstimator]
+        if estimator == 'mean':
+            values = plots['sum']/plots['count']
+        else:
+            values = plots[estimator]
+        frame = values.rename(self.plotY).reset_index()
+        frame.columns = [self.plotX] + ([self.plotHue] if len(frame.columns) > 2 else []) + [self.plotY]
+        return frame
+
+    def flows(self):
+        """
+        Returns every row kept for popups as one dataframe in the order the rows were read, indexed by row number.
+        """
+        kept = pd.concat(list(self.top.values()))
+        kept = kept[~kept.index.duplicated()].sort_index()
+        return kept.drop(columns = [c for c in LOCATION + EDGE + keys.IDS if c in kept.columns])
@@ -0,0 +1,116 @@
+"""
+Popup table rendering for Ra maps.
+Writes the popup table markup directly instead of going through DataFrame.to_html and a chain of str.replace calls,
+which is slow for the many tiny tables a map needs.
+"""
+
+import pandas as pd
+import numpy as np
+from pandas.io.formats.format import format_array
+
+HEAD = '<table border="5" class="dataframe">\n  <thead align = "center">\n    <tr style="text-align: center;">\n      <th></th>\n'
+BODY = '    </tr>\n  </thead>\n  <tbody>\n'
+FOOT = '  </tbody>\n</table>'
+
+def legacyTable(df):
+    """
+    Renders a popup table with DataFrame.to_html, used for frames renderTable does not handle.
+    """
+    return df.to_html(escape = False).replace('<td>','<td align = "center">').replace('<thead>','<thead align = "center">').replace('border="1"','border="5"').replace('<tr style="text-align: right;">','<tr style="text-align: center;">')
+
+def supported(df):
+    """
+    Checks if renderTable writes the same markup as legacyTable for df.
+    Frames with a named or non integer index, multi level columns, columns that are not plain numpy
+    numbers, booleans or objects (e.g. datetimes, categoricals) or strings that would be truncated are left to legacyTable.
+    """
+    return (df.index.name == None and df.index.dtype.kind in 'iu' and
+            not isinstance(df.columns, pd.MultiIndex) and len(df.columns) > 0 and
+            all((isinstance(t, np.dtype) and t.kind in 'iubfO') or isinstance(t, pd.StringDtype) for t in df.dtypes) and
+            pd.get_option('display.max_colwidth') == None)
+
+def plainStrings(strings):
+    """
+    Checks if every value is a string pandas writes as is.
+    """
+    return all(type(v) == str and '\t' not in v and '\n' not in v and '\r' not in v for v in strings)
+
+def independent(values):
+    """
+    Checks if the formatting of each value in a column does not depend on the other values of the column.
+    """
+    return values.dtype.kind in 'iub' or (values.dtype.kind == 'O' and plainStrings(values.tolist()))
+
+def formatColumn(values):
+    """
+    Formats the values of one column the way DataFrame.to_html does, returns a list of strings.
+    Plain strings, integers and booleans are written directly, anything else is formatted by pandas.
+    """
+    kind = values.dtype.kind
+    if kind in 'iub':
+        return [str(v) for v in values.tolist()]
+    if kind == 'O':
+        strings = values.tolist()
+        if plainStrings(strings):
+            return [v.strip() for v in strings]
+    return [s.strip() for s in format_array(values, None)]
+
+def renderTable(df):
+    """
+    Creates the html table for a popup from already truncated rows.
+    Writes the same markup as DataFrame.to_html followed by the popup replacements in one pass.
+    """
+    if not supported(df):
+        return legacyTable(df)
+    columns = [formatColumn(column.to_numpy()) for label, column in df.items()]
+    return write(df.columns, df.index.tolist(), columns)
+
+def write(labels, index, columns):
+    """
+    Writes the table markup from column labels, index labels and formatted columns.
+    """
+    html = [HEAD]
+    for label in labels:
+        html.append('      <th>%s</th>\n' % label)
+    html.append(BODY)
+    for i, name in enumerate(index):
+        html.append('    <tr>\n      <th>%s</th>\n' % name)
+        for column in columns:
+            html.append('      <td align = "center">%s</td>\n' % column[i])
+        html.append('    </tr>\n')
+    html.append(FOOT)
+    return ''.join(html)
+
+def renderTables(df, groups, resetIndex = False, columns = None):
+    """
+    Creates the popup tables of many groups of rows of df at once.
+    groups: Dictionary of key: row positions (e.g. from groupby().indices), already truncated to the popup length.
+    resetIndex: Number the rows of each table from 0 instead of showing the index of df.
+    columns: The columns of df shown in the tables. Default = None (Every column)
+    Returns a dictionary of key: html.
+    Columns that do not depend on the other rows of a table (strings, integers, booleans) are formatted once for the whole frame.
+    """
+    if columns == None:
+        columns = list(df.columns)
+    if not supported(df.iloc[:0][columns]):
+        tables = {}
+        for key, positions in groups.items():
+            temp = df.iloc[positions][columns]
+            if resetIndex:
+                temp = temp.reset_index(drop = True)
+            tables[key] = legacyTable(temp)
+        return tables
+    values = [df[label].to_numpy() for label in columns]
+    shared = [np.array(formatColumn(v), dtype = object) if independent(v) else None for v in values]
+    index = np.array([str(i) for i in df.index.tolist()], dtype = object)
+    tables = {}
+    for key, positions in groups.items():
+        cells = []
+        for v, s in zip(values, shared):
+            if s is not None:
+                cells.append(s[positions])
+            else:
+                cells.append(formatColumn(v[positions]))
+        labels = range(len(positions)) if resetIndex else index[positions]
+        tables[key] = write(columns, labels, cells)
+    return tables